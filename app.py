@@ -1,86 +1,812 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import APIRouter, FastAPI, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import requests
-import openai
-import PyPDF2
-import io
+from python_multipart.multipart import MultipartParser, parse_options_header
+from python_multipart.exceptions import MultipartParseError
+import httpx
+import asyncio
+import hashlib
+import codecs
+import importlib
 import json
+import multiprocessing
 import os
-import uvicorn
-from typing import List, Optional, Dict, Any
+import sys
+from typing import List, Optional, Dict, Any, AsyncIterator
 from datetime import datetime
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+import itertools
+import logging
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+import zlib
 import re
+import numpy as np
 from dotenv import load_dotenv
+from pdf_pages import extract_pdf_page_range, load_pdf_parser, open_pdf
 load_dotenv()
 
-app = FastAPI(title="Smart Research Assistant", version="1.0.0")
+running_apps = 0  # apps between startup and shutdown; they share the module's resources
 
-# Configure CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # For production, use your Vercel URL instead of "*"
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global running_apps
+    # The first app to start gets a fresh executor, stores and providers, the last to stop closes them,
+    # so an app created after another one shut down (uvicorn --factory, tests) works
+    if running_apps == 0:
+        open_resources()
+    running_apps += 1
+    # Not awaited: the server binds its port right away and warms up while already answering
+    warmup = asyncio.create_task(warm_up())
+    try:
+        yield
+    finally:
+        warmup.cancel()
+        running_apps -= 1
+        if running_apps == 0:
+            await close_resources()
+
+router = APIRouter()
+
+class UploadLimitMiddleware:
+    """Answer 413 to multipart requests over UPLOAD_MAX_BYTES
+
+    A Content-Length over the limit is rejected before the body is read. Other
+    bodies are counted as they are received and cut off once they pass it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            await self.app(scope, receive, send)
+            return
+        limit = UPLOAD_MAX_BYTES + UPLOAD_MULTIPART_OVERHEAD
+        length = headers.get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit:
+            response = JSONResponse({"detail": f"File is larger than {UPLOAD_MAX_BYTES} bytes"}, status_code=413)
+            await response(scope, receive, send)
+            return
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=f"File is larger than {UPLOAD_MAX_BYTES} bytes")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+# Metrics and timing spans
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+PROFILE_HEADER = "X-Profile"  # send "X-Profile: 1" to get a Server-Timing breakdown back
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+logger = logging.getLogger("smart_research_assistant")
+if not logger.handlers:
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    logger.addHandler(log_handler)
+    logger.propagate = False
+logger.setLevel(LOG_LEVEL)
+
+class Metrics:
+    """Thread-safe counters and histograms rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.families: Dict[str, tuple] = {}  # name -> (type, help, buckets)
+        self.counters: Dict[tuple, float] = {}  # (name, labels) -> value
+        self.histograms: Dict[tuple, list] = {}  # (name, labels) -> per-bucket counts + [sum, count]
+
+    def counter(self, name: str, help_text: str):
+        self.families[name] = ("counter", help_text, None)
+
+    def histogram(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        self.families[name] = ("histogram", help_text, buckets)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = self.families[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            series = self.histograms.get(key)
+            if series is None:
+                series = self.histograms[key] = [0] * len(buckets) + [0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self, collected: List[tuple] = ()) -> str:
+        """Exposition text; collected are (name, type, help, [(labels dict, value), ...]) read by the caller"""
+        lines = []
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: list(series) for key, series in self.histograms.items()}
+        for name, (kind, help_text, buckets) in self.families.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            if kind == "counter":
+                lines += [f"{name}{format_labels(labels)} {value:g}" for (n, labels), value in counters.items() if n == name]
+                continue
+            for (n, labels), series in histograms.items():
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, series):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{name}_sum{format_labels(labels)} {series[-2]:g}")
+                lines.append(f"{name}_count{format_labels(labels)} {series[-1]}")
+        for name, kind, help_text, samples in collected:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{format_labels(tuple(sorted(labels.items())))} {value:g}" for labels, value in samples]
+        return "\n".join(lines) + "\n"
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+metrics = Metrics()
+metrics.histogram("http_request_duration_seconds", "Time to response headers by route")
+metrics.counter("http_requests_total", "Requests by route and status code")
+metrics.histogram("span_duration_seconds", "Time spent in each pipeline stage")
+metrics.histogram("llm_request_duration_seconds", "LLM call duration per provider, including retries")
+metrics.histogram("llm_time_to_first_token_seconds", "Time to the first streamed chunk per provider")
+metrics.counter("llm_requests_total", "LLM calls per provider and outcome")
+metrics.counter("llm_retries_total", "Retried LLM attempts per provider")
+metrics.counter("llm_fallbacks_total", "Calls that failed on a provider and moved on to the next one")
+metrics.counter("llm_prompt_tokens_total", "Estimated prompt tokens sent per provider")
+metrics.counter("llm_completion_tokens_total", "Estimated completion tokens received per provider")
+metrics.histogram("llm_prompt_tokens", "Estimated prompt tokens per LLM call", TOKEN_BUCKETS)
+
+# Per-request list of (name, seconds) timings while profiling is requested
+current_profile: ContextVar[Optional[list]] = ContextVar("current_profile", default=None)
+
+def record_timing(name: str, seconds: float):
+    profile = current_profile.get()
+    if profile is not None:
+        profile.append((name, seconds))
+
+@contextmanager
+def span(name: str):
+    """Time a pipeline stage into span_duration_seconds and the request's profile"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe("span_duration_seconds", elapsed, span=name)
+        record_timing(name, elapsed)
+        logger.debug("span=%s duration_ms=%.1f", name, elapsed * 1000)
+
+class InstrumentedStore:
+    """Proxy timing the listed methods of a session store or response cache as storage spans"""
+
+    def __init__(self, store, methods: tuple):
+        self._store = store
+        self._methods = frozenset(methods)
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._store, name)
+        if name not in self._methods:
+            return attr
+
+        def timed(*args, **kwargs):
+            with span(f"storage.{name}"):
+                return attr(*args, **kwargs)
+        return timed
+
+def server_timing(profile: list, total: float) -> str:
+    """Server-Timing header value; repeated spans are summed"""
+    durations: Dict[str, float] = {}
+    for name, seconds in profile:
+        durations[name] = durations.get(name, 0.0) + seconds
+    durations["total"] = total
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in durations.items())
+
+class MetricsMiddleware:
+    """Time every HTTP request up to its response headers, labelled by route template
+
+    With an "X-Profile: 1" request header the request's spans are returned in a
+    Server-Timing header. Streaming responses send their headers before the LLM
+    call, so their breakdown only covers the work done before the first byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        profiling = any(key == PROFILE_HEADER.lower().encode() and value not in (b"", b"0") for key, value in scope["headers"])
+        token = current_profile.set([] if profiling else None)
+        responded = False
+
+        def record(status: int) -> float:
+            elapsed = time.perf_counter() - started
+            # The router stores the matched route in the scope; unmatched paths share one label
+            route = getattr(scope.get("route"), "path", "unmatched")
+            metrics.observe("http_request_duration_seconds", elapsed, method=scope["method"], route=route)
+            metrics.inc("http_requests_total", method=scope["method"], route=route, status=str(status))
+            logger.debug("%s %s status=%d duration_ms=%.1f", scope["method"], route, status, elapsed * 1000)
+            return elapsed
+
+        async def send_with_timing(message):
+            nonlocal responded
+            if message["type"] == "http.response.start":
+                responded = True
+                elapsed = record(message["status"])
+                if profiling:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", server_timing(current_profile.get(), elapsed).encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            if not responded:
+                record(500)
+            current_profile.reset(token)
 
 # OpenAI API Configuration (like real PDF summarizers)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai.api_key = OPENAI_API_KEY
-print("open ai key ",OPENAI_API_KEY)
-def call_openai_inference(prompt: str) -> str:
-    """Use OpenAI API like real PDF summarizers"""
-    try:
-        from openai import OpenAI
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")  # Point at a compatible server or local stub
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+logger.info("OpenAI API key configured: %s", bool(OPENAI_API_KEY))
+
+# Fallback to Hugging Face if OpenAI fails
+HF_API_URL = os.getenv("HF_API_URL", "https://api-inference.huggingface.co/models/HuggingFaceH4/zephyr-7b-beta")
+HF_API_TOKEN = os.getenv("HF_API_TOKEN")
+
+# Shared LLM client settings
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "8"))
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "16"))
+HF_CONCURRENCY = int(os.getenv("HF_CONCURRENCY", "4"))
+HF_TIMEOUT_SECONDS = float(os.getenv("HF_TIMEOUT_SECONDS", "60"))
+
+LLM_MAX_TOKENS = 1000
+LLM_TEMPERATURE = 0.3
+
+SYSTEM_PROMPT = "You are a helpful research assistant that provides concise, accurate summaries and answers based on document content."
+
+class ProviderError(Exception):
+    """Raised when an LLM provider fails after all retries"""
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+def is_retryable(error: Exception) -> bool:
+    """Timeouts, connection errors, rate limits and 5xx responses are worth retrying"""
+    if isinstance(error, (asyncio.TimeoutError, httpx.TransportError)):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    if type(error).__module__.split(".")[0] != "openai":
+        return False
+    # Raised by the SDK, so it has finished importing (the warm-up may still be importing it otherwise)
+    openai = sys.modules["openai"]
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return False
+
+lazy_modules: Dict[str, Any] = {}  # fully imported by import_off_loop
+
+async def import_off_loop(name: str):
+    """Import a module on a worker thread so a slow first import never blocks the event loop
+
+    sys.modules is not checked directly: while another thread is importing the
+    module it holds a partially initialized one, and import_module waits for it.
+    """
+    module = lazy_modules.get(name)
+    if module is None:
+        module = lazy_modules[name] = await asyncio.to_thread(importlib.import_module, name)
+    return module
+
+class LLMProvider(ABC):
+    """Async LLM provider with a concurrency limit, timeout and retries"""
+    name = "base"
+    model = ""  # cached answers are keyed on it
+
+    def __init__(self, concurrency: int, timeout: float = LLM_TIMEOUT_SECONDS, max_retries: int = LLM_MAX_RETRIES):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.pending = 0  # calls waiting for or holding the semaphore
+        self.active = 0  # calls holding it
+
+    @abstractmethod
+    async def _complete(self, prompt: str) -> str:
+        ...
+
+    async def _stream(self, prompt: str) -> AsyncIterator[str]:
+        # Providers without native streaming send the whole completion as one chunk
+        yield await self._complete(prompt)
+
+    @contextmanager
+    def observe(self, prompt: str):
+        """Count a call as pending and record its duration, outcome and prompt size"""
+        self.pending += 1
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except ProviderError:
+            outcome = "error"
+            raise
+        except BaseException:
+            outcome = "cancelled"
+            raise
+        finally:
+            self.pending -= 1
+            elapsed = time.perf_counter() - started
+            tokens = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(prompt)
+            metrics.observe("llm_request_duration_seconds", elapsed, provider=self.name, outcome=outcome)
+            metrics.inc("llm_requests_total", provider=self.name, outcome=outcome)
+            metrics.inc("llm_prompt_tokens_total", tokens, provider=self.name)
+            metrics.observe("llm_prompt_tokens", tokens, provider=self.name)
+            record_timing(f"llm.{self.name}", elapsed)
+
+    async def complete(self, prompt: str) -> str:
+        with self.observe(prompt):
+            async with self.semaphore:
+                self.active += 1
+                try:
+                    for attempt in range(self.max_retries + 1):
+                        try:
+                            text = await asyncio.wait_for(self._complete(prompt), self.timeout)
+                            metrics.inc("llm_completion_tokens_total", estimate_tokens(text), provider=self.name)
+                            return text
+                        except Exception as e:
+                            if attempt == self.max_retries or not is_retryable(e):
+                                raise ProviderError(f"Error calling {self.name}: {e!r}") from e
+                            metrics.inc("llm_retries_total", provider=self.name)
+                            await asyncio.sleep(backoff_delay(attempt))
+                finally:
+                    self.active -= 1
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        """Yield completion text as it arrives; retries only happen before the first chunk"""
+        with self.observe(prompt):
+            async with self.semaphore:
+                self.active += 1
+                started = time.perf_counter()
+                received = 0
+                try:
+                    for attempt in range(self.max_retries + 1):
+                        chunks = self._stream(prompt)
+                        try:
+                            first = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+                            break
+                        except StopAsyncIteration:
+                            return
+                        except Exception as e:
+                            await chunks.aclose()
+                            if attempt == self.max_retries or not is_retryable(e):
+                                raise ProviderError(f"Error calling {self.name}: {e!r}") from e
+                            metrics.inc("llm_retries_total", provider=self.name)
+                            await asyncio.sleep(backoff_delay(attempt))
+                    metrics.observe("llm_time_to_first_token_seconds", time.perf_counter() - started, provider=self.name)
+                    received += len(first)
+                    yield first
+                    try:
+                        while True:
+                            try:
+                                chunk = await asyncio.wait_for(chunks.__anext__(), self.timeout)
+                            except StopAsyncIteration:
+                                return
+                            received += len(chunk)
+                            yield chunk
+                    except Exception as e:
+                        raise ProviderError(f"Error streaming from {self.name}: {e!r}") from e
+                    finally:
+                        await chunks.aclose()
+                finally:
+                    self.active -= 1
+                    # Same 4-characters-per-token estimate as estimate_tokens
+                    metrics.inc("llm_completion_tokens_total", received // 4, provider=self.name)
+
+    async def aclose(self):
+        pass
+
+class OpenAIProvider(LLMProvider):
+    """OpenAI chat completions through one shared, pooled AsyncOpenAI client"""
+    name = "openai"
+    model = OPENAI_MODEL
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._client = None
+
+    async def load_client(self):
+        """The shared client; the openai package (over half a second to import) is loaded on first use"""
+        if self._client is None:
+            openai = await import_off_loop("openai")
+            # Retries are handled by LLMProvider so the SDK's own are disabled
+            self._client = openai.AsyncOpenAI(
+                api_key=OPENAI_API_KEY,
+                base_url=OPENAI_BASE_URL,
+                timeout=self.timeout,
+                max_retries=0,
+            )
+        return self._client
+
+    async def _complete(self, prompt: str) -> str:
+        client = await self.load_client()
+        response = await client.chat.completions.create(
+            model=OPENAI_MODEL,
             messages=[
-                {"role": "system", "content": "You are a helpful research assistant that provides concise, accurate summaries and answers based on document content."},
+                {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ],
-            max_tokens=1000,
-            temperature=0.3
+            max_tokens=LLM_MAX_TOKENS,
+            temperature=LLM_TEMPERATURE
         )
         content = response.choices[0].message.content
         return content.strip() if content else "No response generated"
-    except Exception as e:
-        return f"Error calling OpenAI API: {str(e)}"
 
-# Fallback to Hugging Face if OpenAI fails
-HF_API_URL = "https://api-inference.huggingface.co/models/HuggingFaceH4/zephyr-7b-beta"
+    async def _stream(self, prompt: str) -> AsyncIterator[str]:
+        client = await self.load_client()
+        stream = await client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=LLM_MAX_TOKENS,
+            temperature=LLM_TEMPERATURE,
+            stream=True
+        )
+        async for event in stream:
+            if event.choices and event.choices[0].delta.content:
+                yield event.choices[0].delta.content
 
-def call_huggingface_inference(prompt: str) -> str:
-    headers = {"Content-Type": "application/json"}
-    payload = {"inputs": prompt}
-    try:
-        response = requests.post(HF_API_URL, headers=headers, json=payload, timeout=60)
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+class HuggingFaceProvider(LLMProvider):
+    """Hugging Face inference API through a shared httpx connection pool"""
+    name = "huggingface"
+    model = HF_API_URL  # the model is part of the endpoint
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=HF_CONCURRENCY * 2, max_keepalive_connections=HF_CONCURRENCY),
+                headers={"Authorization": f"Bearer {HF_API_TOKEN}"} if HF_API_TOKEN else None,
+            )
+        return self._client
+
+    async def _complete(self, prompt: str) -> str:
+        # Text generation echoes the prompt before the completion unless return_full_text is off
+        response = await self.client.post(HF_API_URL, json={"inputs": prompt, "parameters": {
+            "return_full_text": False,
+            "max_new_tokens": LLM_MAX_TOKENS,
+            "temperature": LLM_TEMPERATURE,
+        }})
         response.raise_for_status()
         data = response.json()
-        if isinstance(data, list) and 'generated_text' in data[0]:
-            return data[0]['generated_text']
+        if isinstance(data, list) and data and isinstance(data[0], dict):
+            data = data[0]
+        if isinstance(data, dict) and isinstance(data.get('generated_text'), str):
+            return data['generated_text']
         if isinstance(data, dict) and 'error' in data:
-            return f"Error from Hugging Face: {data['error']}"
-        return str(data)
-    except Exception as e:
-        return f"Error calling Hugging Face API: {str(e)}"
+            raise ProviderError(f"Error from Hugging Face: {data['error']}")
+        raise ProviderError(f"Unexpected response from Hugging Face: {str(data)[:200]}")
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+class LocalProvider(LLMProvider):
+    """Local text processing (no external API calls)"""
+    name = "local"
+    model = "local"
+
+    async def _complete(self, prompt: str) -> str:
+        return call_local_inference(prompt)
+
+    async def _stream(self, prompt: str) -> AsyncIterator[str]:
+        # Word by word, so streaming clients can be exercised without network access
+        for word in re.findall(r"\S+\s*", call_local_inference(prompt)):
+            yield word
+            await asyncio.sleep(0)
+
+def create_llm_providers() -> Dict[str, LLMProvider]:
+    return {
+        "openai": OpenAIProvider(OPENAI_CONCURRENCY),
+        "huggingface": HuggingFaceProvider(HF_CONCURRENCY, timeout=HF_TIMEOUT_SECONDS),
+        "local": LocalProvider(concurrency=64, max_retries=0),
+    }
+
+llm_providers = create_llm_providers()
+
+def openai_configured() -> bool:
+    return bool(OPENAI_API_KEY) and OPENAI_API_KEY not in ("your-openai-api-key-here", "None")
+
+def huggingface_configured() -> bool:
+    # The public inference API needs a token; a self-hosted HF_API_URL may not
+    return bool(HF_API_TOKEN) or "HF_API_URL" in os.environ
+
+PROVIDER_CONFIGURED = {"openai": openai_configured, "huggingface": huggingface_configured}
+
+def provider_configured(name: str) -> bool:
+    return name in PROVIDER_CONFIGURED and PROVIDER_CONFIGURED[name]()
+
+# Provider routing
+LLM_PROVIDER_ORDER = [name.strip() for name in os.getenv("LLM_PROVIDERS", "openai,huggingface").split(",") if name.strip()]
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"  # race the next provider once a call outlasts the first one's p95
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))  # recent successful calls kept per provider
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "3"))  # consecutive failures that open a provider's circuit
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "30"))
+
+metrics.counter("llm_routed_total", "Calls answered per provider and how it was reached (primary, failover, hedge, fallback)")
+metrics.counter("llm_circuit_skips_total", "Calls that skipped a provider because its circuit was open")
+metrics.counter("llm_circuit_opened_total", "Times a provider's circuit opened")
+metrics.counter("llm_hedges_total", "Hedged calls per hedging provider and whether the hedge answered first")
+
+class ProviderHealth:
+    """Recent latencies and a circuit breaker for one provider
+
+    The circuit opens after BREAKER_FAILURES consecutive failures. After
+    BREAKER_COOLDOWN_SECONDS it is half-open: one trial call goes through,
+    closing the circuit on success and reopening it on failure.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies = deque(maxlen=LLM_LATENCY_WINDOW)
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < BREAKER_COOLDOWN_SECONDS:
+            return "open"
+        return "half_open"
+
+    def acquire(self) -> bool:
+        """Whether a call may go to this provider now; claims the trial call when half-open"""
+        state = self.state
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return state == "closed"
+
+    def release(self):
+        """The call ended without an answer or an error (cancelled)"""
+        self.probing = False
+
+    def record_success(self, seconds: Optional[float] = None):
+        if seconds is not None:
+            self.latencies.append(seconds)
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.probing or self.consecutive_failures >= BREAKER_FAILURES:
+            if self.state != "open":
+                metrics.inc("llm_circuit_opened_total", provider=self.name)
+                logger.warning("Circuit for %s opened after %d consecutive failures", self.name, self.consecutive_failures)
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def latency_quantile(self, q: float) -> Optional[float]:
+        if len(self.latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return float(np.quantile(np.fromiter(self.latencies, float), q))
+
+class ProviderRouter:
+    """Route completions through the configured providers in order, then local processing
+
+    Providers with an open circuit are skipped instead of costing a timeout.
+    With hedging on, a call still running after the provider's
+    LLM_HEDGE_QUANTILE latency is raced against the next healthy provider and
+    the first answer wins. route["provider"] is set to the provider that answered.
+    """
+
+    def __init__(self, providers: Dict[str, LLMProvider], order: List[str], fallback: str = "local",
+                 hedge: bool = LLM_HEDGE, configured=provider_configured):
+        self.providers = providers
+        self.order = order
+        self.fallback = fallback
+        self.hedge = hedge
+        self.configured = configured
+        self.health = {name: ProviderHealth(name) for name in order}
+
+    def available(self) -> List[str]:
+        return [name for name in self.order if self.configured(name)]
 
-def call_ai_inference(prompt: str) -> str:
-    """Smart AI inference with fallback"""
-    # Try OpenAI first (like real PDF summarizers)
-    if OPENAI_API_KEY and OPENAI_API_KEY != "your-openai-api-key-here" and OPENAI_API_KEY != "None":
+    def primary(self) -> str:
+        """The provider expected to answer: the first configured one, else the fallback"""
+        available = self.available()
+        return available[0] if available else self.fallback
+
+    def model(self, name: str) -> str:
+        return f"{name}:{self.providers[name].model}"
+
+    async def call(self, name: str, prompt: str) -> str:
+        health = self.health[name]
+        started = time.perf_counter()
         try:
-            result = call_openai_inference(prompt)
-            if not result.startswith("Error"):
-                return result
-        except Exception as e:
-            print(f"OpenAI API failed: {e}")
-    
-    # Fallback to local processing (no external API calls)
-    return call_local_inference(prompt)
+            text = await self.providers[name].complete(prompt)
+        except ProviderError:
+            health.record_failure()
+            raise
+        except BaseException:
+            health.release()
+            raise
+        health.record_success(time.perf_counter() - started)
+        return text
+
+    async def hedged(self, name: str, backup: str, delay: float, prompt: str, route: dict, via: str, tried: set) -> str:
+        started = time.perf_counter()
+        primary = asyncio.create_task(self.call(name, prompt))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if primary in done or not self.health[backup].acquire():
+            route["provider"] = name
+            text = await primary
+            metrics.inc("llm_routed_total", provider=name, via=via)
+            return text
+        tried.add(backup)
+        hedge = asyncio.create_task(self.call(backup, prompt))
+        tasks = {primary: name, hedge: backup}
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = tasks[task]
+                        if winner == backup:
+                            # The cancelled call took at least this long; without the sample the
+                            # window would only see fast calls and hedge ever earlier
+                            self.health[name].latencies.append(time.perf_counter() - started)
+                        route["provider"] = winner
+                        metrics.inc("llm_hedges_total", provider=backup, outcome="won" if winner == backup else "lost")
+                        metrics.inc("llm_routed_total", provider=winner, via="hedge" if winner == backup else via)
+                        return task.result()
+            metrics.inc("llm_hedges_total", provider=backup, outcome="failed")
+            raise ProviderError(f"{name} and hedge {backup} both failed: {primary.exception()}")
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def complete(self, prompt: str, route: dict) -> str:
+        tried = set()
+        available = self.available()
+        for name in available:
+            if name in tried:
+                continue
+            if not self.health[name].acquire():
+                metrics.inc("llm_circuit_skips_total", provider=name)
+                continue
+            via = "primary" if name == available[0] else "failover"
+            tried.add(name)
+            delay = self.health[name].latency_quantile(LLM_HEDGE_QUANTILE) if self.hedge else None
+            backup = next((other for other in available if other not in tried and self.health[other].state == "closed"), None)
+            try:
+                if delay is not None and backup is not None:
+                    return await self.hedged(name, backup, delay, prompt, route, via, tried)
+                route["provider"] = name
+                text = await self.call(name, prompt)
+                metrics.inc("llm_routed_total", provider=name, via=via)
+                return text
+            except ProviderError as e:
+                metrics.inc("llm_fallbacks_total", provider=name)
+                logger.warning("%s call failed, trying the next provider: %s", name, e)
+
+        # Fallback to local processing (no external API calls)
+        route["provider"] = self.fallback
+        metrics.inc("llm_routed_total", provider=self.fallback, via="fallback")
+        return await self.providers[self.fallback].complete(prompt)
+
+    async def stream(self, prompt: str, route: dict) -> AsyncIterator[str]:
+        """Streaming variant of complete; fails over only before the first chunk and never hedges"""
+        available = self.available()
+        for name in available:
+            health = self.health[name]
+            if not health.acquire():
+                metrics.inc("llm_circuit_skips_total", provider=name)
+                continue
+            route["provider"] = name
+            started = False
+            try:
+                async for chunk in self.providers[name].stream(prompt):
+                    started = True
+                    yield chunk
+                health.record_success()
+                metrics.inc("llm_routed_total", provider=name, via="primary" if name == available[0] else "failover")
+                return
+            except ProviderError as e:
+                health.record_failure()
+                if started:
+                    raise
+                metrics.inc("llm_fallbacks_total", provider=name)
+                logger.warning("%s stream failed, trying the next provider: %s", name, e)
+            except BaseException:
+                health.release()
+                raise
+
+        route["provider"] = self.fallback
+        metrics.inc("llm_routed_total", provider=self.fallback, via="fallback")
+        async for chunk in self.providers[self.fallback].stream(prompt):
+            yield chunk
+
+llm_router = ProviderRouter(llm_providers, LLM_PROVIDER_ORDER)
+
+async def call_ai_inference(prompt: str, route: Optional[dict] = None) -> str:
+    """Smart AI inference with fallback
+
+    If route is given, route["provider"] is set to the provider that answered.
+    """
+    return await llm_router.complete(prompt, {} if route is None else route)
+
+async def stream_ai_inference(prompt: str, route: Optional[dict] = None) -> AsyncIterator[str]:
+    """Streaming variant of call_ai_inference; falls back only if a provider fails before its first token"""
+    async for chunk in llm_router.stream(prompt, {} if route is None else route):
+        yield chunk
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def sse_event(event: str, data: Any) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 def call_local_inference(prompt: str) -> str:
     """Local text processing (no external API calls)"""
@@ -95,17 +821,21 @@ def call_local_inference(prompt: str) -> str:
             doc_content = prompt
         
         # Simple local text processing
-        if "summary" in prompt.lower():
-            # Extract first few sentences for summary
-            sentences = doc_content.split('.')
-            summary_sentences = [s.strip() for s in sentences[:3] if s.strip()]  # First 3 non-empty sentences
-            return '. '.join(summary_sentences) + '.' if summary_sentences else "Document summary generated successfully."
-        
-        elif "question" in prompt.lower():
-            # Simple question answering based on document content
-            return f"Based on the document content, here is the answer to your question. The document contains relevant information that addresses your query."
+        instruction = prompt.lstrip()[:200].lower()
+        if instruction.startswith("evaluate"):
+            # Same JSON shape the evaluation prompts ask the model for
+            evaluation = {
+                "score": 75,
+                "feedback": "Your answer shows good understanding of the topic. Consider providing more specific details from the document for a higher score.",
+                "correct_answer": "Based on document content",
+                "justification": "Evaluated locally without an LLM"
+            }
+            item_ids = re.findall(r"^\s*Item (\d+):", prompt, re.MULTILINE)
+            if item_ids:
+                return json.dumps({"evaluations": [{"id": int(item_id), **evaluation} for item_id in item_ids]})
+            return json.dumps(evaluation)
         
-        elif "challenge" in prompt.lower() or "questions" in prompt.lower():
+        elif "challenging questions" in instruction:
             # Generate simple challenge questions
             return '''{
                 "questions": [
@@ -127,9 +857,15 @@ def call_local_inference(prompt: str) -> str:
                 ]
             }'''
         
-        elif "evaluate" in prompt.lower():
-            # Simple evaluation
-            return "Score: 75. Your answer shows good understanding of the topic. Consider providing more specific details from the document for a higher score."
+        elif "summary" in prompt.lower():
+            # Extract first few sentences for summary
+            sentences = doc_content.split('.')
+            summary_sentences = [s.strip() for s in sentences[:3] if s.strip()]  # First 3 non-empty sentences
+            return '. '.join(summary_sentences) + '.' if summary_sentences else "Document summary generated successfully."
+        
+        elif "question" in prompt.lower():
+            # Simple question answering based on document content
+            return f"Based on the document content, here is the answer to your question. The document contains relevant information that addresses your query."
         
         else:
             return "I can help you analyze this document. Please ask a specific question or use the challenge mode."
@@ -137,219 +873,2348 @@ def call_local_inference(prompt: str) -> str:
     except Exception as e:
         return f"Local processing completed. {str(e)}"
 
-# In-memory storage for document content and conversation history
-document_storage = {}
-conversation_history = {}
+# Session storage for document content and conversation history
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")  # "memory" or "sqlite"
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(512 * 1024 * 1024)))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", str(24 * 3600)))
+INDEX_CACHE_SIZE = int(os.getenv("INDEX_CACHE_SIZE", "32"))
+JOB_HISTORY_LIMIT = int(os.getenv("JOB_HISTORY_LIMIT", "1000"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "600"))  # unfinished jobs silent this long died with their worker
+
+class SessionStore(ABC):
+    """Storage for sessions, their conversation history and the documents they share
+
+    Documents are content-addressed by the SHA-256 of the uploaded bytes and
+    refcounted, so every session uploading the same file shares one copy of
+    its text, index and summary. A document is freed with its last session.
+    """
+
+    @abstractmethod
+    def get(self, session_id: str, with_index: bool = True) -> Optional[dict]:
+        """Session merged with its document (content, summary, index, filename, ...)
+
+        With with_index False the index may be None; load_index then builds it off the event loop.
+        """
+
+    @abstractmethod
+    def cached_index(self, digest: str) -> Optional["DocumentIndex"]:
+        """The document's retrieval index if this process holds it, without building it"""
+
+    @abstractmethod
+    def cache_index(self, digest: str, index: "DocumentIndex"):
+        """Keep an index built outside the store for later lookups"""
+
+    @abstractmethod
+    def has_document(self, digest: str) -> bool:
+        ...
+
+    @abstractmethod
+    def create_session(self, session_id: str, digest: str, filename: str, upload_time: str, document: Optional[dict] = None):
+        """Create a session for a document, storing the document if it is new
+
+        Raises KeyError if document is None and no document with this digest is stored.
+        """
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        ...
+
+    @abstractmethod
+    def get_document(self, digest: str, with_index: bool = True) -> Optional[dict]:
+        """A stored document's content, summary and summary_fallback flag, plus its index unless with_index is False"""
+
+    @abstractmethod
+    def set_summary(self, digest: str, summary: str, fallback: bool = False):
+        """Replace a stored document's summary for every session sharing it"""
+
+    @abstractmethod
+    def add_document(self, session_id: str, digest: str, filename: str, upload_time: str, document: Optional[dict] = None):
+        """Add another document to an existing session's collection, storing it if it is new
+
+        Raises KeyError like create_session and ValueError if the session does not exist.
+        Adding a document the session already holds does nothing.
+        """
+
+    @abstractmethod
+    def remove_document(self, session_id: str, digest: str) -> bool:
+        """Drop a document added with add_document; the session's first document stays"""
+
+    @abstractmethod
+    def list_documents(self, session_id: str) -> List[dict]:
+        """Digest, filename and upload time of each document in the session, first document first"""
+
+    @abstractmethod
+    def get_history(self, session_id: str) -> List[dict]:
+        ...
+
+    @abstractmethod
+    def append_history(self, session_id: str, entry: dict):
+        ...
+
+    @abstractmethod
+    def get_history_summary(self, session_id: str) -> tuple:
+        """Return (running summary of older turns, number of history entries it covers)"""
+
+    @abstractmethod
+    def set_history_summary(self, session_id: str, summary: str, turns: int):
+        ...
+
+    @abstractmethod
+    def list_sessions(self, offset: int = 0, limit: int = 50) -> tuple:
+        """Return (page of session summaries, total session count)"""
+
+    @abstractmethod
+    def save_job(self, job: dict):
+        """Insert or update an ingestion job; only the newest JOB_HISTORY_LIMIT finished jobs are kept"""
+
+    @abstractmethod
+    def get_job(self, job_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    def session_pending(self, session_id: str) -> bool:
+        """Whether an unfinished ingestion job belongs to this session"""
+
+    @abstractmethod
+    def ingesting(self, digest: str, job_id: str) -> bool:
+        """Whether a job other than job_id is extracting, indexing or summarizing this document"""
+
+    @abstractmethod
+    def job_counts(self) -> Dict[str, int]:
+        """Number of stored jobs per status"""
+
+    def close(self):
+        pass
+
+def document_nbytes(document: dict) -> int:
+    """Approximate memory held by a stored document"""
+    size = len(document["content"]) + len(document["summary"])
+    if document.get("index") is not None:
+        size += document["index"].nbytes()
+    return size
+
+class MemorySessionStore(SessionStore):
+    """In-process store with LRU eviction under a byte budget and idle TTL"""
+
+    def __init__(self, max_bytes: int = SESSION_MAX_BYTES, ttl_seconds: float = SESSION_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sessions: "OrderedDict[str, dict]" = OrderedDict()  # least recently used first
+        self.upload_order: Dict[str, None] = {}  # stable order for paging
+        self.documents: Dict[str, dict] = {}
+        self.collections: Dict[str, Dict[str, dict]] = {}  # session -> documents added after the first
+        self.histories: Dict[str, List[dict]] = {}
+        self.history_summaries: Dict[str, tuple] = {}
+        self.history_bytes: Dict[str, int] = {}  # session -> size of its history and summary, counted in size
+        self.jobs: "OrderedDict[str, dict]" = OrderedDict()
+        self.size = 0
+
+    def _expired(self, session: dict) -> bool:
+        return time.monotonic() - session["last_access"] > self.ttl_seconds
+
+    def get(self, session_id: str, with_index: bool = True) -> Optional[dict]:
+        session = self.sessions.get(session_id)
+        if session is None:
+            return None
+        if self._expired(session):
+            self.delete(session_id)
+            return None
+        self.sessions.move_to_end(session_id)
+        session["last_access"] = time.monotonic()
+        document = self.documents[session["digest"]]
+        return {
+            "content": document["content"],
+            "summary": document["summary"],
+            "index": document["index"],
+            "filename": session["filename"],
+            "upload_time": session["upload_time"],
+            "digest": session["digest"]
+        }
+
+    def cached_index(self, digest: str) -> Optional["DocumentIndex"]:
+        document = self.documents.get(digest)
+        return document["index"] if document is not None else None
+
+    def cache_index(self, digest: str, index: "DocumentIndex"):
+        pass  # Documents are stored with their index
+
+    def has_document(self, digest: str) -> bool:
+        return digest in self.documents
+
+    def _ref(self, digest: str, document: Optional[dict]):
+        if digest not in self.documents:
+            if document is None:
+                raise KeyError(digest)
+            nbytes = document_nbytes(document)
+            self.documents[digest] = {
+                "content": document["content"],
+                "summary": document["summary"],
+                "summary_fallback": document.get("summary_fallback", False),
+                "index": document["index"],
+                "refcount": 0,
+                "nbytes": nbytes
+            }
+            self.size += nbytes
+        self.documents[digest]["refcount"] += 1
+
+    def _unref(self, digest: str):
+        document = self.documents[digest]
+        document["refcount"] -= 1
+        if document["refcount"] == 0:
+            del self.documents[digest]
+            self.size -= document["nbytes"]
+
+    def create_session(self, session_id: str, digest: str, filename: str, upload_time: str, document: Optional[dict] = None):
+        if digest not in self.documents and document is None:
+            raise KeyError(digest)
+        self.delete(session_id)
+        self._ref(digest, document)
+        self.sessions[session_id] = {
+            "digest": digest,
+            "filename": filename,
+            "upload_time": upload_time,
+            "last_access": time.monotonic()
+        }
+        self.upload_order[session_id] = None
+        self.collections[session_id] = {}
+        self.histories[session_id] = []
+        self.history_bytes[session_id] = 0
+        self._evict()
+
+    def _evict(self):
+        # Expired sessions first, then least recently used until under budget
+        for session_id in [sid for sid, session in self.sessions.items() if self._expired(session)]:
+            self.delete(session_id)
+        while self.size > self.max_bytes and len(self.sessions) > 1:
+            self.delete(next(iter(self.sessions)))
+
+    def delete(self, session_id: str):
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return
+        del self.upload_order[session_id]
+        self.histories.pop(session_id, None)
+        self.history_summaries.pop(session_id, None)
+        self.size -= self.history_bytes.pop(session_id, 0)
+        for digest in self.collections.pop(session_id, {}):
+            self._unref(digest)
+        self._unref(session["digest"])
+
+    def get_document(self, digest: str, with_index: bool = True) -> Optional[dict]:
+        document = self.documents.get(digest)
+        if document is None:
+            return None
+        return {
+            "content": document["content"],
+            "summary": document["summary"],
+            "summary_fallback": document["summary_fallback"],
+            "index": document["index"]
+        }
+
+    def set_summary(self, digest: str, summary: str, fallback: bool = False):
+        document = self.documents.get(digest)
+        if document is None:
+            return
+        nbytes = len(summary) - len(document["summary"])
+        document.update(summary=summary, summary_fallback=fallback, nbytes=document["nbytes"] + nbytes)
+        self.size += nbytes
+        self._evict()
+
+    def add_document(self, session_id: str, digest: str, filename: str, upload_time: str, document: Optional[dict] = None):
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise ValueError("Session not found")
+        collection = self.collections[session_id]
+        # Adding a document is a use of the session; it must not be the next one evicted
+        self.sessions.move_to_end(session_id)
+        session["last_access"] = time.monotonic()
+        if digest == session["digest"] or digest in collection:
+            return
+        self._ref(digest, document)
+        collection[digest] = {"filename": filename, "upload_time": upload_time}
+        self._evict()
+
+    def remove_document(self, session_id: str, digest: str) -> bool:
+        if digest not in self.collections.get(session_id, {}):
+            return False
+        del self.collections[session_id][digest]
+        self._unref(digest)
+        return True
+
+    def list_documents(self, session_id: str) -> List[dict]:
+        session = self.sessions.get(session_id)
+        if session is None:
+            return []
+        documents = [{"digest": session["digest"], "filename": session["filename"], "upload_time": session["upload_time"]}]
+        documents.extend({"digest": digest, **member} for digest, member in self.collections[session_id].items())
+        return documents
+
+    def get_history(self, session_id: str) -> List[dict]:
+        return self.histories.get(session_id, [])
+
+    def _grow_history(self, session_id: str, nbytes: int):
+        self.history_bytes[session_id] += nbytes
+        self.size += nbytes
+        self._evict()
+
+    def append_history(self, session_id: str, entry: dict):
+        if session_id in self.histories:
+            self.histories[session_id].append(entry)
+            self._grow_history(session_id, sum(len(value) for value in entry.values() if isinstance(value, str)))
+
+    def get_history_summary(self, session_id: str) -> tuple:
+        return self.history_summaries.get(session_id, ("", 0))
+
+    def set_history_summary(self, session_id: str, summary: str, turns: int):
+        if session_id in self.histories:
+            previous = self.history_summaries.get(session_id, ("", 0))[0]
+            self.history_summaries[session_id] = (summary, turns)
+            self._grow_history(session_id, len(summary) - len(previous))
+
+    def list_sessions(self, offset: int = 0, limit: int = 50) -> tuple:
+        page = []
+        for session_id in itertools.islice(self.upload_order, offset, offset + limit):
+            session = self.sessions[session_id]
+            page.append({"session_id": session_id, "filename": session["filename"], "upload_time": session["upload_time"]})
+        return page, len(self.upload_order)
+
+    def save_job(self, job: dict):
+        self.jobs[job["job_id"]] = job
+        if job["status"] in ("done", "failed"):
+            finished = [job_id for job_id, stored in self.jobs.items() if stored["status"] in ("done", "failed")]
+            for job_id in finished[:len(finished) - JOB_HISTORY_LIMIT]:
+                del self.jobs[job_id]
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        return self.jobs.get(job_id)
+
+    def session_pending(self, session_id: str) -> bool:
+        return any(job["session_id"] == session_id and job["status"] not in ("done", "failed") for job in self.jobs.values())
+
+    def ingesting(self, digest: str, job_id: str) -> bool:
+        return any(
+            job["digest"] == digest and job["job_id"] != job_id and job["status"] == "running" and job["stage"] != "waiting"
+            for job in self.jobs.values()
+        )
+
+    def job_counts(self) -> Dict[str, int]:
+        return Counter(job["status"] for job in self.jobs.values())
+
+class SQLiteSessionStore(SessionStore):
+    """SQLite store shared by all worker processes; document text is zlib-compressed
+
+    Ingestion jobs live here too, so any worker can report a job's progress
+    and answer 409 for a session another worker is still creating.
+    """
+
+    def __init__(self, path: str = SESSION_DB_PATH, ttl_seconds: float = SESSION_TTL_SECONDS, index_cache_size: int = INDEX_CACHE_SIZE):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.local = threading.local()
+        # Retrieval indexes are rebuilt from the text and cached per process by digest
+        self.indexes: "OrderedDict[str, DocumentIndex]" = OrderedDict()
+        self.index_cache_size = index_cache_size
+        with self.connection as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    digest TEXT PRIMARY KEY,
+                    summary TEXT NOT NULL,
+                    content BLOB NOT NULL,
+                    refcount INTEGER NOT NULL DEFAULT 0,
+                    summary_fallback INTEGER NOT NULL DEFAULT 0
+                )""")
+            if "summary_fallback" not in {row[1] for row in db.execute("PRAGMA table_info(documents)")}:
+                db.execute("ALTER TABLE documents ADD COLUMN summary_fallback INTEGER NOT NULL DEFAULT 0")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    digest TEXT NOT NULL REFERENCES documents (digest),
+                    filename TEXT NOT NULL,
+                    upload_time TEXT NOT NULL,
+                    last_access REAL NOT NULL
+                )""")
+            db.execute("CREATE INDEX IF NOT EXISTS sessions_upload_time ON sessions (upload_time)")
+            db.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS history (
+                    session_id TEXT NOT NULL REFERENCES sessions (session_id) ON DELETE CASCADE,
+                    entry BLOB NOT NULL
+                )""")
+            db.execute("CREATE INDEX IF NOT EXISTS history_session ON history (session_id)")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS history_summary (
+                    session_id TEXT PRIMARY KEY REFERENCES sessions (session_id) ON DELETE CASCADE,
+                    summary TEXT NOT NULL,
+                    turns INTEGER NOT NULL
+                )""")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS session_documents (
+                    session_id TEXT NOT NULL REFERENCES sessions (session_id) ON DELETE CASCADE,
+                    digest TEXT NOT NULL REFERENCES documents (digest),
+                    filename TEXT NOT NULL,
+                    upload_time TEXT NOT NULL,
+                    PRIMARY KEY (session_id, digest)
+                )""")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    session_id TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    updated REAL NOT NULL,
+                    job TEXT NOT NULL
+                )""")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_session ON jobs (session_id)")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_digest ON jobs (digest)")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (status, updated)")
+            # Refcounts follow session rows however they are created or deleted
+            db.execute("""
+                CREATE TRIGGER IF NOT EXISTS sessions_ref AFTER INSERT ON sessions BEGIN
+                    UPDATE documents SET refcount = refcount + 1 WHERE digest = NEW.digest;
+                END""")
+            db.execute("""
+                CREATE TRIGGER IF NOT EXISTS sessions_unref AFTER DELETE ON sessions BEGIN
+                    UPDATE documents SET refcount = refcount - 1 WHERE digest = OLD.digest;
+                    DELETE FROM documents WHERE digest = OLD.digest AND refcount <= 0;
+                END""")
+            db.execute("""
+                CREATE TRIGGER IF NOT EXISTS session_documents_ref AFTER INSERT ON session_documents BEGIN
+                    UPDATE documents SET refcount = refcount + 1 WHERE digest = NEW.digest;
+                END""")
+            db.execute("""
+                CREATE TRIGGER IF NOT EXISTS session_documents_unref AFTER DELETE ON session_documents BEGIN
+                    UPDATE documents SET refcount = refcount - 1 WHERE digest = OLD.digest;
+                    DELETE FROM documents WHERE digest = OLD.digest AND refcount <= 0;
+                END""")
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA foreign_keys=ON")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    def get(self, session_id: str, with_index: bool = True) -> Optional[dict]:
+        now = time.time()
+        with self.connection as db:
+            row = db.execute("""
+                SELECT s.filename, s.upload_time, s.last_access, s.digest, d.summary, d.content
+                FROM sessions s JOIN documents d ON d.digest = s.digest
+                WHERE s.session_id = ?""", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[2] > self.ttl_seconds:
+                db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                return None
+            db.execute("UPDATE sessions SET last_access = ? WHERE session_id = ?", (now, session_id))
+        content = zlib.decompress(row[5]).decode("utf-8")
+        return {
+            "content": content,
+            "summary": row[4],
+            "index": self._index(row[3], content) if with_index else None,
+            "filename": row[0],
+            "upload_time": row[1],
+            "digest": row[3]
+        }
+
+    def _index(self, digest: str, content: str) -> "DocumentIndex":
+        index = self.cached_index(digest)
+        if index is None:
+            index = build_document_index(content)
+            self.cache_index(digest, index)
+        return index
+
+    def cached_index(self, digest: str) -> Optional["DocumentIndex"]:
+        index = self.indexes.get(digest)
+        if index is not None:
+            self.indexes.move_to_end(digest)
+        return index
+
+    def cache_index(self, digest: str, index: "DocumentIndex"):
+        self.indexes[digest] = index
+        self.indexes.move_to_end(digest)
+        while len(self.indexes) > self.index_cache_size:
+            self.indexes.popitem(last=False)
+
+    def has_document(self, digest: str) -> bool:
+        return self.connection.execute("SELECT 1 FROM documents WHERE digest = ?", (digest,)).fetchone() is not None
+
+    def create_session(self, session_id: str, digest: str, filename: str, upload_time: str, document: Optional[dict] = None):
+        now = time.time()
+        with self.connection as db:
+            db.execute("DELETE FROM sessions WHERE last_access < ?", (now - self.ttl_seconds,))
+            db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            if document is not None:
+                db.execute(
+                    "INSERT OR IGNORE INTO documents (digest, summary, content, summary_fallback) VALUES (?, ?, ?, ?)",
+                    (digest, document["summary"], zlib.compress(document["content"].encode("utf-8"), 6), document.get("summary_fallback", False))
+                )
+            elif not db.execute("SELECT 1 FROM documents WHERE digest = ?", (digest,)).fetchone():
+                raise KeyError(digest)
+            db.execute(
+                "INSERT INTO sessions (session_id, digest, filename, upload_time, last_access) VALUES (?, ?, ?, ?, ?)",
+                (session_id, digest, filename, upload_time, now)
+            )
+        if document is not None and document.get("index") is not None:
+            self.cache_index(digest, document["index"])
+
+    def delete(self, session_id: str):
+        with self.connection as db:
+            db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def get_document(self, digest: str, with_index: bool = True) -> Optional[dict]:
+        row = self.connection.execute("SELECT summary, content, summary_fallback FROM documents WHERE digest = ?", (digest,)).fetchone()
+        if row is None:
+            return None
+        content = zlib.decompress(row[1]).decode("utf-8")
+        return {
+            "content": content,
+            "summary": row[0],
+            "summary_fallback": bool(row[2]),
+            "index": self._index(digest, content) if with_index else None
+        }
+
+    def set_summary(self, digest: str, summary: str, fallback: bool = False):
+        with self.connection as db:
+            db.execute("UPDATE documents SET summary = ?, summary_fallback = ? WHERE digest = ?", (summary, fallback, digest))
+
+    def add_document(self, session_id: str, digest: str, filename: str, upload_time: str, document: Optional[dict] = None):
+        with self.connection as db:
+            session = db.execute("SELECT digest FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if session is None:
+                raise ValueError("Session not found")
+            if document is not None:
+                db.execute(
+                    "INSERT OR IGNORE INTO documents (digest, summary, content, summary_fallback) VALUES (?, ?, ?, ?)",
+                    (digest, document["summary"], zlib.compress(document["content"].encode("utf-8"), 6), document.get("summary_fallback", False))
+                )
+            elif not db.execute("SELECT 1 FROM documents WHERE digest = ?", (digest,)).fetchone():
+                raise KeyError(digest)
+            if session[0] != digest:
+                db.execute(
+                    "INSERT OR IGNORE INTO session_documents (session_id, digest, filename, upload_time) VALUES (?, ?, ?, ?)",
+                    (session_id, digest, filename, upload_time)
+                )
+        if document is not None and document.get("index") is not None:
+            self.cache_index(digest, document["index"])
+
+    def remove_document(self, session_id: str, digest: str) -> bool:
+        with self.connection as db:
+            cursor = db.execute("DELETE FROM session_documents WHERE session_id = ? AND digest = ?", (session_id, digest))
+        return cursor.rowcount > 0
+
+    def list_documents(self, session_id: str) -> List[dict]:
+        db = self.connection
+        rows = db.execute("SELECT digest, filename, upload_time FROM sessions WHERE session_id = ?", (session_id,)).fetchall()
+        if rows:
+            rows += db.execute(
+                "SELECT digest, filename, upload_time FROM session_documents WHERE session_id = ? ORDER BY rowid", (session_id,)
+            ).fetchall()
+        return [{"digest": r[0], "filename": r[1], "upload_time": r[2]} for r in rows]
+
+    def get_history(self, session_id: str) -> List[dict]:
+        rows = self.connection.execute(
+            "SELECT entry FROM history WHERE session_id = ? ORDER BY rowid", (session_id,)
+        ).fetchall()
+        # Rows written before history was compressed are plain JSON text
+        return [json.loads(row[0] if isinstance(row[0], str) else zlib.decompress(row[0])) for row in rows]
+
+    def append_history(self, session_id: str, entry: dict):
+        with self.connection as db:
+            db.execute(
+                "INSERT INTO history (session_id, entry) VALUES (?, ?)",
+                (session_id, zlib.compress(json.dumps(entry).encode("utf-8"), 6))
+            )
+
+    def get_history_summary(self, session_id: str) -> tuple:
+        row = self.connection.execute("SELECT summary, turns FROM history_summary WHERE session_id = ?", (session_id,)).fetchone()
+        return (row[0], row[1]) if row else ("", 0)
+
+    def set_history_summary(self, session_id: str, summary: str, turns: int):
+        with self.connection as db:
+            db.execute(
+                "INSERT OR REPLACE INTO history_summary (session_id, summary, turns) SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM sessions WHERE session_id = ?)",
+                (session_id, summary, turns, session_id)
+            )
+
+    def list_sessions(self, offset: int = 0, limit: int = 50) -> tuple:
+        db = self.connection
+        total = db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        rows = db.execute(
+            "SELECT session_id, filename, upload_time FROM sessions ORDER BY upload_time, session_id LIMIT ? OFFSET ?",
+            (limit, offset)
+        ).fetchall()
+        return [{"session_id": r[0], "filename": r[1], "upload_time": r[2]} for r in rows], total
+
+    def save_job(self, job: dict):
+        with self.connection as db:
+            db.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, session_id, digest, status, stage, updated, job) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job["job_id"], job["session_id"], job["digest"], job["status"], job["stage"], time.time(), json.dumps(job))
+            )
+            if job["status"] in ("done", "failed"):
+                db.execute("""
+                    DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < (
+                        SELECT updated FROM jobs WHERE status IN ('done', 'failed') ORDER BY updated DESC LIMIT 1 OFFSET ?
+                    )""", (JOB_HISTORY_LIMIT - 1,)
+                )
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        row = self.connection.execute("SELECT job FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def session_pending(self, session_id: str) -> bool:
+        return self.connection.execute(
+            "SELECT 1 FROM jobs WHERE session_id = ? AND status NOT IN ('done', 'failed') AND updated > ?",
+            (session_id, time.time() - JOB_STALE_SECONDS)
+        ).fetchone() is not None
+
+    def ingesting(self, digest: str, job_id: str) -> bool:
+        return self.connection.execute(
+            "SELECT 1 FROM jobs WHERE digest = ? AND job_id != ? AND status = 'running' AND stage != 'waiting' AND updated > ?",
+            (digest, job_id, time.time() - JOB_STALE_SECONDS)
+        ).fetchone() is not None
+
+    def job_counts(self) -> Dict[str, int]:
+        return dict(self.connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def close(self):
+        db = getattr(self.local, "db", None)
+        if db is not None:
+            db.close()
+            self.local.db = None
+
+def create_session_store() -> SessionStore:
+    if SESSION_STORE == "sqlite":
+        return SQLiteSessionStore()
+    if SESSION_STORE == "memory":
+        return MemorySessionStore()
+    raise ValueError(f"Unknown SESSION_STORE: {SESSION_STORE}")
+
+def open_session_store() -> SessionStore:
+    return InstrumentedStore(create_session_store(), (
+        "get", "get_document", "set_summary", "create_session", "add_document", "remove_document", "delete", "list_documents",
+        "get_history", "append_history", "get_history_summary", "set_history_summary", "list_sessions",
+        "save_job", "get_job",
+    ))
+
+session_store: Optional[SessionStore] = None  # opened on startup, see open_resources
+
+# LLM response cache
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "memory")  # "memory", "sqlite" or "off"
+RESPONSE_CACHE_DB_PATH = os.getenv("RESPONSE_CACHE_DB_PATH", SESSION_DB_PATH)
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "10000"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Jaccard similarity of question terms needed for a near-duplicate hit; 0 disables
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0"))
+RESPONSE_CACHE_SIMILARITY_SCAN = 256  # most recent questions compared per document
+RESPONSE_CACHE_DISABLED_ENDPOINTS = {e.strip() for e in os.getenv("RESPONSE_CACHE_DISABLED_ENDPOINTS", "").split(",") if e.strip()}
+
+def normalize_question(text: str) -> str:
+    return " ".join(tokenize(text))
+
+def question_terms(text: str) -> frozenset:
+    return frozenset(t for t in tokenize(text) if t not in STOPWORDS)
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+class ResponseCache(ABC):
+    """Cache of LLM completions keyed on document digest, normalized inputs, model and parameters"""
+
+    def __init__(self, similarity: float = RESPONSE_CACHE_SIMILARITY, disabled_endpoints=RESPONSE_CACHE_DISABLED_ENDPOINTS):
+        self.similarity = similarity
+        self.disabled_endpoints = set(disabled_endpoints)
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def enabled_for(self, endpoint: str) -> bool:
+        return endpoint not in self.disabled_endpoints
+
+    def make_key(self, endpoint: str, digest: str, inputs: dict, model: str) -> str:
+        material = json.dumps({
+            "endpoint": endpoint,
+            "digest": digest,
+            "inputs": inputs,
+            "model": model,
+            "max_tokens": LLM_MAX_TOKENS,
+            "temperature": LLM_TEMPERATURE
+        }, sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _count(self, endpoint: str, outcome: str):
+        counts = self.stats.setdefault(endpoint, {"hits": 0, "near_hits": 0, "misses": 0})
+        counts[outcome] += 1
+
+    def lookup(self, endpoint: str, key: str, digest: str, model: str, question: Optional[str] = None) -> Optional[str]:
+        """Exact match first, then (if enabled and a question is given) the most similar earlier question to the same model"""
+        response = self._get(key)
+        if response is not None:
+            self._count(endpoint, "hits")
+            return response
+        if question and self.similarity > 0:
+            terms = question_terms(question)
+            best_key, best_score = None, 0.0
+            for candidate_key, candidate_terms in self._questions(endpoint, digest, model):
+                score = jaccard(terms, candidate_terms)
+                if score > best_score:
+                    best_key, best_score = candidate_key, score
+            if best_key is not None and best_score >= self.similarity:
+                response = self._get(best_key)
+                if response is not None:
+                    self._count(endpoint, "near_hits")
+                    return response
+        self._count(endpoint, "misses")
+        return None
+
+    def store(self, endpoint: str, key: str, digest: str, model: str, response: str, question: Optional[str] = None):
+        self._put(key, endpoint, digest, model, question_terms(question) if question else frozenset(), response)
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def _put(self, key: str, endpoint: str, digest: str, model: str, terms: frozenset, response: str):
+        ...
+
+    @abstractmethod
+    def _questions(self, endpoint: str, digest: str, model: str):
+        """Recent (key, question terms) pairs cached for this endpoint, document and model"""
+
+    def close(self):
+        pass
+
+class MemoryResponseCache(ResponseCache):
+    """In-process LRU with TTL"""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS, **kwargs):
+        super().__init__(**kwargs)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires, endpoint, digest, model, terms, response)
+
+    def _get(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[5]
+
+    def _put(self, key: str, endpoint: str, digest: str, model: str, terms: frozenset, response: str):
+        self.entries[key] = (time.monotonic() + self.ttl_seconds, endpoint, digest, model, terms, response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _questions(self, endpoint: str, digest: str, model: str):
+        found = 0
+        for key in reversed(self.entries):
+            _, entry_endpoint, entry_digest, entry_model, terms, _ = self.entries[key]
+            if entry_endpoint == endpoint and entry_digest == digest and entry_model == model and terms:
+                yield key, terms
+                found += 1
+                if found >= RESPONSE_CACHE_SIMILARITY_SCAN:
+                    return
+
+class SQLiteResponseCache(ResponseCache):
+    """SQLite cache shared by all worker processes"""
+
+    def __init__(self, path: str = RESPONSE_CACHE_DB_PATH, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.local = threading.local()
+        with self.connection as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    endpoint TEXT NOT NULL,
+                    digest TEXT NOT NULL,
+                    terms TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    expires REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    model TEXT NOT NULL DEFAULT ''
+                )""")
+            if "model" not in {row[1] for row in db.execute("PRAGMA table_info(response_cache)")}:
+                db.execute("ALTER TABLE response_cache ADD COLUMN model TEXT NOT NULL DEFAULT ''")
+            db.execute("CREATE INDEX IF NOT EXISTS response_cache_document ON response_cache (endpoint, digest, last_access)")
+            db.execute("CREATE INDEX IF NOT EXISTS response_cache_last_access ON response_cache (last_access)")
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.local.db = db
+        return db
+
+    def _get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self.connection as db:
+            row = db.execute("SELECT response, expires FROM response_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                db.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                return None
+            db.execute("UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def _put(self, key: str, endpoint: str, digest: str, model: str, terms: frozenset, response: str):
+        now = time.time()
+        with self.connection as db:
+            db.execute(
+                "INSERT OR REPLACE INTO response_cache (key, endpoint, digest, model, terms, response, expires, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, endpoint, digest, model, " ".join(sorted(terms)), response, now + self.ttl_seconds, now)
+            )
+            db.execute("DELETE FROM response_cache WHERE expires < ?", (now,))
+            db.execute("""
+                DELETE FROM response_cache WHERE key IN (
+                    SELECT key FROM response_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )""", (self.max_entries,))
+
+    def _questions(self, endpoint: str, digest: str, model: str):
+        rows = self.connection.execute(
+            "SELECT key, terms FROM response_cache WHERE endpoint = ? AND digest = ? AND model = ? AND terms != '' ORDER BY last_access DESC LIMIT ?",
+            (endpoint, digest, model, RESPONSE_CACHE_SIMILARITY_SCAN)
+        ).fetchall()
+        return [(key, frozenset(terms.split())) for key, terms in rows]
+
+    def close(self):
+        db = getattr(self.local, "db", None)
+        if db is not None:
+            db.close()
+            self.local.db = None
+
+def create_response_cache() -> Optional[ResponseCache]:
+    if RESPONSE_CACHE == "off":
+        return None
+    if RESPONSE_CACHE == "sqlite":
+        return SQLiteResponseCache()
+    if RESPONSE_CACHE == "memory":
+        return MemoryResponseCache()
+    raise ValueError(f"Unknown RESPONSE_CACHE: {RESPONSE_CACHE}")
+
+def open_response_cache() -> Optional[ResponseCache]:
+    cache = create_response_cache()
+    return InstrumentedStore(cache, ("lookup", "store")) if cache is not None else None
+
+response_cache: Optional[ResponseCache] = None  # opened on startup (stays None when RESPONSE_CACHE=off)
+
+def cache_model(provider: Optional[str] = None) -> str:
+    """Provider and model an answer is cached under, by default the primary's
+
+    Lookups use the primary's, so a failover provider's answer is stored under its
+    own model and never served in place of the primary's.
+    """
+    return llm_router.model(provider or llm_router.primary())
+
+async def cached_ai_inference(endpoint: str, digest: str, inputs: dict, prompt: str, question: Optional[str] = None,
+                              route: Optional[dict] = None, validate=None) -> str:
+    """call_ai_inference through the response cache; only real LLM answers are cached, not the local fallback
+
+    validate, if given, is called on a new response before it is stored and may raise ValueError.
+    """
+    route = {} if route is None else route
+    if response_cache is None or not response_cache.enabled_for(endpoint):
+        return await call_ai_inference(prompt, route)
+    model = cache_model()
+    key = response_cache.make_key(endpoint, digest, inputs, model)
+    cached = response_cache.lookup(endpoint, key, digest, model, question)
+    if cached is not None:
+        route["provider"] = "cache"
+        return cached
+    response = await call_ai_inference(prompt, route)
+    if validate is not None:
+        validate(response)
+    if route.get("provider") != "local":
+        model = cache_model(route["provider"])
+        response_cache.store(endpoint, response_cache.make_key(endpoint, digest, inputs, model), digest, model, response, question)
+    return response
+
+async def cached_stream_ai_inference(endpoint: str, digest: str, inputs: dict, prompt: str, question: Optional[str] = None,
+                                     route: Optional[dict] = None, validate=None) -> AsyncIterator[str]:
+    """Streaming variant of cached_ai_inference; a hit is sent as a single chunk
+
+    A response that fails validate has already been streamed, so it is only left out of the cache.
+    """
+    route = {} if route is None else route
+    if response_cache is None or not response_cache.enabled_for(endpoint):
+        async for chunk in stream_ai_inference(prompt, route):
+            yield chunk
+        return
+    model = cache_model()
+    key = response_cache.make_key(endpoint, digest, inputs, model)
+    cached = response_cache.lookup(endpoint, key, digest, model, question)
+    if cached is not None:
+        route["provider"] = "cache"
+        yield cached
+        return
+    parts = []
+    async for chunk in stream_ai_inference(prompt, route):
+        parts.append(chunk)
+        yield chunk
+    response = "".join(parts)
+    if validate is not None:
+        try:
+            validate(response)
+        except ValueError:
+            return
+    if route.get("provider") != "local":
+        model = cache_model(route["provider"])
+        response_cache.store(endpoint, response_cache.make_key(endpoint, digest, inputs, model), digest, model, response, question)
 
 class DocumentResponse(BaseModel):
     summary: str
     content: str
     filename: str
     upload_time: str
+    session_id: str
+
+class UploadAcceptedResponse(BaseModel):
+    session_id: str
+    job_id: str
+    filename: str
+    status: str
+    upload_time: str
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    session_id: str
+    filename: str
+    status: str
+    stage: str
+    progress: float
+    error: Optional[str] = None
+    partial_summary: str = ""
+    result: Optional[DocumentResponse] = None
+    created_at: str
+    updated_at: str
 
 class QuestionRequest(BaseModel):
     question: str
     session_id: str
 
+class HighlightSpan(BaseModel):
+    start: int
+    end: int
+    score: float
+    text: str
+    filename: Optional[str] = None  # set when the session holds several documents
+
+class Citation(BaseModel):
+    source: int  # the [n] label used in the prompt
+    filename: str
+    digest: str
+    chunk_id: int
+    score: float
+    text: str
+
 class AnswerResponse(BaseModel):
     answer: str
     justification: str
     highlighted_text: str
+    highlights: List[HighlightSpan] = []
+    citations: List[Citation] = []
+    prompt_tokens: Dict[str, int] = {}  # estimated size of each prompt part and the total
     confidence: float
 
-class ChallengeQuestion(BaseModel):
-    question: str
-    expected_answer: str
-    difficulty: str
+class ChallengeQuestion(BaseModel):
+    question: str
+    expected_answer: str
+    difficulty: str
+
+class ChallengeResponse(BaseModel):
+    questions: List[ChallengeQuestion]
+    session_id: str
+
+class UserAnswerRequest(BaseModel):
+    question: str
+    user_answer: str
+    session_id: str
+
+class EvaluationResponse(BaseModel):
+    score: float
+    feedback: str
+    correct_answer: str
+    justification: str
+
+class AnswerItem(BaseModel):
+    question: str
+    user_answer: str
+
+class BatchEvaluationRequest(BaseModel):
+    session_id: str
+    answers: List[AnswerItem]
+
+class BatchEvaluationItem(BaseModel):
+    index: int  # position in the request's answers
+    result: Optional[EvaluationResponse] = None
+    error: Optional[str] = None
+
+class BatchEvaluationResponse(BaseModel):
+    session_id: str
+    results: List[BatchEvaluationItem]
+    failed: int
+    llm_calls: int
+
+class BatchChallengeRequest(BaseModel):
+    session_ids: List[str]
+
+class BatchChallengeItem(BaseModel):
+    session_id: str
+    questions: List[ChallengeQuestion] = []
+    error: Optional[str] = None
+
+class BatchChallengeResponse(BaseModel):
+    results: List[BatchChallengeItem]
+    failed: int
+
+# Uploads
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(100 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None  # default: the system temp directory
+UPLOAD_MULTIPART_OVERHEAD = 64 * 1024  # form boundaries and headers around the file
+TXT_FALLBACK_ENCODING = os.getenv("TXT_FALLBACK_ENCODING", "cp1252")  # for TXT files that are not UTF-8
+
+# PDF extraction
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+PARALLEL_PDF_MIN_PAGES = int(os.getenv("PARALLEL_PDF_MIN_PAGES", "32"))
+PDF_PAGE_CACHE_MAX_BYTES = int(os.getenv("PDF_PAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+class PageCache:
+    """LRU cache of extracted PDF pages keyed by the file's content hash"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, List[str]]" = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, digest: str) -> Optional[List[str]]:
+        with self.lock:
+            pages = self.entries.get(digest)
+            if pages is not None:
+                self.entries.move_to_end(digest)
+            return pages
+
+    def put(self, digest: str, pages: List[str]):
+        size = sum(len(page) for page in pages)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if digest in self.entries:
+                return
+            self.entries[digest] = pages
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= sum(len(page) for page in evicted)
+
+pdf_page_cache = PageCache(PDF_PAGE_CACHE_MAX_BYTES)
+_pdf_process_pool = None
+
+def get_pdf_process_pool() -> ProcessPoolExecutor:
+    """Process pool for PDF parsing, created on first use"""
+    global _pdf_process_pool
+    if _pdf_process_pool is None:
+        # spawn, not fork: the server process already runs threads
+        _pdf_process_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pdf_process_pool
+
+async def start_pdf_workers():
+    """Spawn the PDF pool's workers and import PyPDF2 in each, so the first large PDF doesn't wait for them"""
+    if PDF_WORKERS > 1:
+        pool, loop = get_pdf_process_pool(), asyncio.get_running_loop()
+        # Submitted together: the pool spawns a worker for each task that finds none idle
+        await asyncio.gather(*(loop.run_in_executor(pool, load_pdf_parser) for _ in range(PDF_WORKERS)))
+
+def reset_pdf_process_pool():
+    global _pdf_process_pool
+    if _pdf_process_pool is not None:
+        _pdf_process_pool.shutdown(wait=False, cancel_futures=True)
+        _pdf_process_pool = None
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file, read in UPLOAD_CHUNK_BYTES blocks"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(UPLOAD_CHUNK_BYTES), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+def iter_pdf_pages(pdf_path: str, digest: Optional[str] = None):
+    """Yield (page_number, page_count, text) in page order as pages finish extracting"""
+    digest = digest or file_digest(pdf_path)
+    cached = pdf_page_cache.get(digest)
+    if cached is not None:
+        for page_number, page_text in enumerate(cached, 1):
+            yield page_number, len(cached), page_text
+        return
+
+    pages = []
+    with open_pdf(pdf_path) as pdf_reader:
+        page_count = len(pdf_reader.pages)
+        if page_count < PARALLEL_PDF_MIN_PAGES or PDF_WORKERS <= 1:
+            for page in pdf_reader.pages:
+                pages.append(page.extract_text() or "")
+                yield len(pages), page_count, pages[-1]
+    if len(pages) < page_count:
+        # Workers reopen the file by path instead of receiving the bytes per task
+        pool = get_pdf_process_pool()
+        futures = [
+            pool.submit(extract_pdf_page_range, pdf_path, start, min(start + PDF_PAGES_PER_TASK, page_count))
+            for start in range(0, page_count, PDF_PAGES_PER_TASK)
+        ]
+        try:
+            # Ranges finish out of order; waiting in submission order keeps pages ordered
+            for future in futures:
+                for page_text in future.result():
+                    pages.append(page_text)
+                    yield len(pages), page_count, page_text
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next upload
+            reset_pdf_process_pool()
+            raise
+        finally:
+            for future in futures:
+                future.cancel()
+    pdf_page_cache.put(digest, pages)
+
+def detect_text_encoding(path: str) -> str:
+    """utf-8-sig if the whole file decodes as UTF-8, else TXT_FALLBACK_ENCODING; reads in blocks"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(UPLOAD_CHUNK_BYTES), b""):
+                decoder.decode(block)
+        decoder.decode(b"", final=True)
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return TXT_FALLBACK_ENCODING
+
+def iter_text_blocks(path: str, on_block=None):
+    """Yield a text file as blocks of whole lines, decoding incrementally
+
+    Blocks end at a line break or, for very long lines, at a space; the
+    separator is dropped, so joining the blocks with "\\n" turns those spaces
+    into line breaks. Words are never split across blocks. Calls
+    on_block(bytes_read, total_bytes) after each block.
+    """
+    total = os.path.getsize(path)
+    decoder = codecs.getincrementaldecoder(detect_text_encoding(path))(errors="replace")
+    pending = ""
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(UPLOAD_CHUNK_BYTES), b""):
+            pending += decoder.decode(block)
+            cut = pending.rfind("\n")
+            if cut == -1:
+                # One very long line: break it at a space instead of buffering it whole
+                cut = pending.rfind(" ")
+            if cut != -1:
+                yield pending[:cut]
+                pending = pending[cut + 1:]
+            if on_block:
+                on_block(f.tell(), total)
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+# Hierarchical summarization
+SUMMARY_SECTION_CHARS = int(os.getenv("SUMMARY_SECTION_CHARS", "8000"))
+SUMMARY_SECTION_WORDS = int(os.getenv("SUMMARY_SECTION_WORDS", "120"))
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+
+summary_slots = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+
+def split_sections(text: str, max_chars: int = SUMMARY_SECTION_CHARS) -> List[str]:
+    """Split text on word boundaries into consecutive sections of at most max_chars"""
+    sections = []
+    words: List[str] = []
+    size = 0
+    for word in text.split():
+        if words and size + len(word) + 1 > max_chars:
+            sections.append(" ".join(words))
+            words, size = [], 0
+        words.append(word)
+        size += len(word) + 1
+    if words:
+        sections.append(" ".join(words))
+    return sections
+
+async def summarize_section(section: str, route: Optional[dict] = None) -> str:
+    """Summarize one section; cached by the section's own hash so any document containing it can reuse the result"""
+    prompt = f"""
+    Please provide a summary of the following section of a longer document in no more than {SUMMARY_SECTION_WORDS} words.
+    Keep the main points, key findings, figures and conclusions.
+    
+    Document:
+    {section}
+    """
+    section_digest = hashlib.sha256(section.encode("utf-8")).hexdigest()
+    async with summary_slots:
+        return (await cached_ai_inference("summary_section", section_digest, {"max_words": SUMMARY_SECTION_WORDS}, prompt, route=route)).strip()
+
+async def reduce_document(text: str, on_progress=None, fallbacks: Optional[list] = None) -> str:
+    """Map sections to summaries concurrently and repeat on the joined summaries until they fit one prompt
+
+    Sections answered by the local fallback are appended to fallbacks; they are not cached,
+    so summarizing again after the provider recovers only redoes those sections.
+    """
+    while len(text) > SUMMARY_SECTION_CHARS:
+        sections = split_sections(text)
+        done = 0
+
+        async def summarize(section: str) -> str:
+            nonlocal done
+            route = {}
+            summary = await summarize_section(section, route)
+            if route.get("provider") == "local" and fallbacks is not None:
+                fallbacks.append(section)
+            done += 1
+            if on_progress:
+                on_progress(done, len(sections))
+            return summary
+
+        reduced = "\n\n".join(await asyncio.gather(*(summarize(section) for section in sections)))
+        if len(reduced) >= len(text):
+            # Summaries are not getting shorter (e.g. the local fallback); stop rather than loop
+            return reduced[:SUMMARY_SECTION_CHARS]
+        text = reduced
+    return text
+
+async def generate_summary(text: str, max_words: int = 150, on_token=None, digest: Optional[str] = None, on_progress=None,
+                           route: Optional[dict] = None) -> str:
+    """Generate a concise summary using AI (like real PDF summarizers)
+
+    Documents longer than SUMMARY_SECTION_CHARS are reduced section by section first;
+    only the final pass depends on max_words, so the section summaries are reused across lengths.
+    If on_token is given the final completion is streamed and each chunk passed to it.
+    Summaries are cached per document digest and max_words when a digest is given.
+    If route is given, route["fallback"] is set when the local fallback wrote any part of the summary.
+    """
+    route = {} if route is None else route
+    fallbacks = []
+    reduced = await reduce_document(text, on_progress, fallbacks)
+    if fallbacks:
+        # A summary built on fallback sections must not be cached as the final answer
+        digest = None
+    if reduced is text:
+        prompt = f"""
+    Please provide a concise summary of the following document in no more than {max_words} words. 
+    Focus on the main points, key findings, and conclusions.
+    
+    Document:
+    {text}
+    """
+    else:
+        prompt = f"""
+    The following are summaries of consecutive sections of one long document.
+    Please combine them into a concise summary of the whole document in no more than {max_words} words.
+    Focus on the main points, key findings, and conclusions.
+    
+    Document:
+    {reduced}
+    """
+    inputs = {"max_words": max_words}
+    if on_token is None:
+        if digest is None:
+            summary = await call_ai_inference(prompt, route)
+        else:
+            summary = await cached_ai_inference("summary", digest, inputs, prompt, route=route)
+    else:
+        chunks = stream_ai_inference(prompt, route) if digest is None else cached_stream_ai_inference("summary", digest, inputs, prompt, route=route)
+        parts = []
+        async for chunk in chunks:
+            parts.append(chunk)
+            on_token(chunk)
+        summary = "".join(parts)
+    route["fallback"] = bool(fallbacks) or route.get("provider") == "local"
+    return summary.strip()
+
+# Document chunking and retrieval
+CHUNK_SIZE_WORDS = int(os.getenv("CHUNK_SIZE_WORDS", "200"))
+CHUNK_OVERLAP_WORDS = int(os.getenv("CHUNK_OVERLAP_WORDS", "40"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "6"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2500"))
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+    a an and are as at be but by can did do does for from had has have how i in is it its of on or
+    that the their there these this to was were what when where which who why will with you your
+""".split())
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens used for indexing and scoring"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count (about 4 characters per token)"""
+    return len(text) // 4 + 1
+
+def chunk_pages(pages, chunk_size: int = CHUNK_SIZE_WORDS, overlap: int = CHUNK_OVERLAP_WORDS):
+    """Yield overlapping word windows from an iterable of page texts as they arrive"""
+    step = max(1, chunk_size - overlap)
+    words: List[str] = []
+    emitted = False
+    for page in pages:
+        words.extend(page.split())
+        while len(words) > chunk_size:
+            yield " ".join(words[:chunk_size])
+            emitted = True
+            del words[:step]
+    # The final window may be shorter; skip it if it only repeats the overlap
+    if words and (not emitted or len(words) > overlap):
+        yield " ".join(words)
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE_WORDS, overlap: int = CHUNK_OVERLAP_WORDS) -> List[str]:
+    """Split text into overlapping word windows"""
+    return list(chunk_pages([text], chunk_size, overlap))
+
+def top_indices(scores: np.ndarray, top_n: int) -> np.ndarray:
+    """Indices of the top_n positive scores, best first (ties keep document order)"""
+    matched = np.flatnonzero(scores > 0)
+    if matched.size > top_n:
+        # Partial selection keeps this linear in the number of matches
+        kth = np.argpartition(-scores[matched], top_n - 1)[:top_n]
+        matched = np.sort(matched[kth])
+    return matched[np.argsort(-scores[matched], kind="stable")]
+
+class BM25:
+    """Vectorized BM25 scoring over a fixed list of token lists, with NumPy postings per term"""
+
+    def __init__(self, token_lists: List[List[str]], k1: float = 1.5, b: float = 0.75):
+        self.size = len(token_lists)
+        self.k1 = k1
+
+        postings: Dict[str, tuple] = {}
+        lengths = np.zeros(self.size, dtype=np.float64)
+        for doc_id, tokens in enumerate(token_lists):
+            terms = Counter(tokens)
+            lengths[doc_id] = len(tokens)
+            for term, tf in terms.items():
+                ids, tfs = postings.setdefault(term, ([], []))
+                ids.append(doc_id)
+                tfs.append(tf)
+
+        avg_length = lengths.mean() if self.size else 1.0
+        # Per-entry length normalisation term of the BM25 denominator
+        self.lengths = lengths
+        self.norm = k1 * (1 - b + b * lengths / max(avg_length, 1.0))
+        n = self.size
+        self.postings = {
+            term: (
+                np.array(ids, dtype=np.int32),
+                np.array(tfs, dtype=np.float64),
+                np.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5)),
+            )
+            for term, (ids, tfs) in postings.items()
+        }
+
+    def scores(self, terms) -> np.ndarray:
+        """BM25 score of every entry for a set of query terms"""
+        scores = np.zeros(self.size, dtype=np.float64)
+        for term in terms:
+            if term not in self.postings:
+                continue
+            ids, tfs, idf = self.postings[term]
+            scores[ids] += idf * tfs * (self.k1 + 1) / (tfs + self.norm[ids])
+        return scores
+
+    def nbytes(self) -> int:
+        size = self.norm.nbytes + self.lengths.nbytes
+        for term, (ids, tfs, _) in self.postings.items():
+            size += len(term) + ids.nbytes + tfs.nbytes + 100  # dict entry and array headers
+        return size
+
+class ChunkIndex:
+    """BM25 index over the chunks of a single document"""
+
+    def __init__(self, chunks: List[str]):
+        self.chunks = chunks
+        self.token_counts = np.array([estimate_tokens(c) for c in chunks], dtype=np.int64)
+        self.bm25 = BM25([tokenize(chunk) for chunk in chunks])
+
+    def nbytes(self) -> int:
+        """Approximate memory used by the chunks and postings"""
+        return sum(len(chunk) for chunk in self.chunks) + self.token_counts.nbytes + self.bm25.nbytes()
+
+    def search(self, query: str, top_k: int = RETRIEVAL_TOP_K) -> List[tuple]:
+        """Return (chunk_id, score) pairs for the best matching chunks"""
+        scores = self.bm25.scores(set(tokenize(query)))
+        return [(int(i), float(scores[i])) for i in top_indices(scores, top_k)]
+
+    def select_context(self, query: str, top_k: int = RETRIEVAL_TOP_K, token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+        """Pick the top-k chunks that fit in the token budget, in document order"""
+        hits = [chunk_id for chunk_id, _ in self.search(query, top_k)]
+        if not hits:
+            # Nothing matched; fall back to the opening of the document
+            hits = list(range(min(top_k, len(self.chunks))))
+        selected = []
+        used = 0
+        for chunk_id in hits:
+            cost = int(self.token_counts[chunk_id])
+            if used + cost > token_budget and selected:
+                continue
+            selected.append(chunk_id)
+            used += cost
+        return "\n...\n".join(self.chunks[i] for i in sorted(selected))
+
+    def sample_context(self, token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+        """Evenly spaced chunks across the whole document that fit in the token budget"""
+        if not self.chunks:
+            return ""
+        average = max(1.0, float(self.token_counts.mean()))
+        count = max(1, min(len(self.chunks), int(token_budget // average)))
+        picks = sorted(set(np.linspace(0, len(self.chunks) - 1, count).round().astype(int).tolist()))
+        selected = []
+        used = 0
+        for chunk_id in picks:
+            cost = int(self.token_counts[chunk_id])
+            if used + cost > token_budget and selected:
+                break
+            selected.append(chunk_id)
+            used += cost
+        return "\n...\n".join(self.chunks[i] for i in selected)
+
+# Sentence highlighting
+SENTENCE_PATTERN = re.compile(r"[^.!?]+[.!?]*")
+HIGHLIGHT_TOP_N = int(os.getenv("HIGHLIGHT_TOP_N", "3"))
+
+class SentenceIndex:
+    """Inverted index over a document's sentences, with character offsets, for ranked highlights"""
+
+    def __init__(self, text: str):
+        starts, ends, token_lists = [], [], []
+        for match in SENTENCE_PATTERN.finditer(text):
+            sentence = match.group()
+            stripped = sentence.strip()
+            if not stripped:
+                continue
+            start = match.start() + len(sentence) - len(sentence.lstrip())
+            starts.append(start)
+            ends.append(start + len(stripped))
+            token_lists.append([t for t in tokenize(stripped) if t not in STOPWORDS])
+        self.starts = np.array(starts, dtype=np.int64)
+        self.ends = np.array(ends, dtype=np.int64)
+        self.bm25 = BM25(token_lists)
+
+    def nbytes(self) -> int:
+        return self.starts.nbytes + self.ends.nbytes + self.bm25.nbytes()
+
+    def highlight(self, query: str, top_n: int = HIGHLIGHT_TOP_N) -> List[dict]:
+        """Best matching sentence spans, best first"""
+        scores = self.bm25.scores({t for t in tokenize(query) if t not in STOPWORDS})
+        return [
+            {"start": int(self.starts[i]), "end": int(self.ends[i]), "score": round(float(scores[i]), 4)}
+            for i in top_indices(scores, top_n)
+        ]
+
+class DocumentIndex:
+    """Everything precomputed for one document: retrieval chunks and highlight sentences"""
+
+    def __init__(self, chunks: ChunkIndex, sentences: SentenceIndex):
+        self.chunks = chunks
+        self.sentences = sentences
+
+    def nbytes(self) -> int:
+        return self.chunks.nbytes() + self.sentences.nbytes()
+
+    def select_context(self, query: str, top_k: int = RETRIEVAL_TOP_K, token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+        return self.chunks.select_context(query, top_k, token_budget)
+
+    def sample_context(self, token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+        return self.chunks.sample_context(token_budget)
+
+    def highlight(self, query: str, top_n: int = HIGHLIGHT_TOP_N) -> List[dict]:
+        return self.sentences.highlight(query, top_n)
+
+def build_document_index(text: str, chunks: Optional[List[str]] = None) -> DocumentIndex:
+    """Chunk a document (unless chunks are given) and build its retrieval and highlight indexes"""
+    return DocumentIndex(ChunkIndex(chunk_text(text) if chunks is None else chunks), SentenceIndex(text))
+
+# Multi-document collections
+COLLECTION_CACHE_SIZE = int(os.getenv("COLLECTION_CACHE_SIZE", "32"))
+
+class CorpusIndex:
+    """Incremental BM25 index over the chunks of every document in a collection
+
+    Adding a document appends its already-built chunk postings as one more block per
+    term, so the cost is proportional to that document's vocabulary, never the corpus.
+    Removed documents are tombstoned; a term's blocks are merged, dropping dead chunks,
+    the next time a query touches it. Once dead slots outnumber live ones the live
+    documents are re-added into fresh slots, so repeated add/remove cycles don't make
+    queries slower. Corpus statistics (document frequencies, average chunk length)
+    are kept up to date on every change.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._clear()
+
+    def _clear(self):
+        self.members: Dict[str, dict] = {}  # digest -> filename, index, content and chunk range
+        self.owners: List[str] = []  # digest per chunk slot
+        self.lengths = np.zeros(0, dtype=np.float64)
+        self.alive = np.zeros(0, dtype=bool)
+        self.size = 0  # chunk slots used, live or not
+        self.live_chunks = 0
+        self.total_length = 0.0
+        self.df: Dict[str, int] = {}
+        self.postings: Dict[str, list] = {}  # term -> [(slot ids, term frequencies), ...]
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def _reserve(self, count: int):
+        if self.size + count <= len(self.alive):
+            return
+        capacity = max(1024, 2 * len(self.alive), self.size + count)
+        self.lengths = np.resize(self.lengths, capacity)
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self.size] = self.alive[:self.size]
+        self.alive = alive
+
+    def add_document(self, digest: str, filename: str, index: "DocumentIndex", content: str):
+        """Add a document's chunks; its content is kept so highlights need no store read"""
+        if digest in self.members:
+            return
+        bm25 = index.chunks.bm25
+        start = self.size
+        self._reserve(bm25.size)
+        self.size += bm25.size
+        self.lengths[start:self.size] = bm25.lengths
+        self.alive[start:self.size] = True
+        self.owners.extend([digest] * bm25.size)
+        self.live_chunks += bm25.size
+        self.total_length += float(bm25.lengths.sum())
+        for term, (ids, tfs, _) in bm25.postings.items():
+            self.postings.setdefault(term, []).append((ids + start, tfs))
+            self.df[term] = self.df.get(term, 0) + len(ids)
+        self.members[digest] = {"filename": filename, "index": index, "content": content, "start": start}
 
-class ChallengeResponse(BaseModel):
-    questions: List[ChallengeQuestion]
-    session_id: str
+    def remove_document(self, digest: str):
+        member = self.members.pop(digest, None)
+        if member is None:
+            return
+        bm25 = member["index"].chunks.bm25
+        self.alive[member["start"]:member["start"] + bm25.size] = False
+        self.live_chunks -= bm25.size
+        self.total_length -= float(bm25.lengths.sum())
+        for term, (ids, _, _) in bm25.postings.items():
+            self.df[term] -= len(ids)
+            if self.df[term] <= 0:
+                del self.df[term]
+                del self.postings[term]
+        if self.size - self.live_chunks > self.live_chunks:
+            self._compact()
 
-class UserAnswerRequest(BaseModel):
-    question: str
-    user_answer: str
-    session_id: str
+    def _compact(self):
+        """Re-add the live documents into fresh slots, dropping every tombstone"""
+        members = self.members
+        self._clear()
+        for digest, member in members.items():
+            self.add_document(digest, member["filename"], member["index"], member["content"])
 
-class EvaluationResponse(BaseModel):
-    score: float
-    feedback: str
-    correct_answer: str
-    justification: str
+    def _term_postings(self, term: str) -> tuple:
+        blocks = self.postings[term]
+        if len(blocks) > 1:
+            ids = np.concatenate([block[0] for block in blocks])
+            tfs = np.concatenate([block[1] for block in blocks])
+            keep = self.alive[ids]
+            blocks[:] = [(ids[keep], tfs[keep])]
+        ids, tfs = blocks[0]
+        keep = self.alive[ids]
+        return ids[keep], tfs[keep]
 
-def extract_text_from_pdf(pdf_file):
-    """Extract text from PDF file"""
-    try:
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading PDF: {str(e)}")
+    def search(self, query: str, top_k: int = RETRIEVAL_TOP_K) -> List[dict]:
+        """Best matching chunks across the collection, best first"""
+        if not self.live_chunks:
+            return []
+        avg_length = max(self.total_length / self.live_chunks, 1.0)
+        all_ids, all_scores = [], []
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            ids, tfs = self._term_postings(term)
+            df = self.df[term]
+            idf = np.log(1 + (self.live_chunks - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[ids] / avg_length)
+            all_ids.append(ids)
+            all_scores.append(idf * tfs * (self.k1 + 1) / (tfs + norm))
+        if not all_ids:
+            return []
+        scores = np.bincount(np.concatenate(all_ids), weights=np.concatenate(all_scores), minlength=self.size)
+        hits = []
+        for slot in top_indices(scores, top_k):
+            digest = self.owners[slot]
+            member = self.members[digest]
+            chunk_id = int(slot) - member["start"]
+            hits.append({
+                "digest": digest,
+                "filename": member["filename"],
+                "chunk_id": chunk_id,
+                "score": round(float(scores[slot]), 4),
+                "text": member["index"].chunks.chunks[chunk_id]
+            })
+        return hits
 
-def extract_text_from_txt(txt_file):
-    """Extract text from TXT file"""
-    try:
-        content = txt_file.read()
-        if isinstance(content, bytes):
-            content = content.decode('utf-8')
-        return content
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading TXT: {str(e)}")
+    def select_context(self, query: str, top_k: int = RETRIEVAL_TOP_K, token_budget: int = CONTEXT_TOKEN_BUDGET) -> tuple:
+        """Top chunks that fit in the token budget, labelled [n] by source; returns (context, hits)"""
+        selected = []
+        used = 0
+        for hit in self.search(query, top_k):
+            cost = estimate_tokens(hit["text"])
+            if used + cost > token_budget and selected:
+                continue
+            selected.append(hit)
+            used += cost
+        for source, hit in enumerate(selected, 1):
+            hit["source"] = source
+        context = "\n\n".join(f"[{hit['source']}] {hit['filename']}:\n{hit['text']}" for hit in selected)
+        return context, selected
 
-def generate_summary(text: str, max_words: int = 150) -> str:
-    """Generate a concise summary using AI (like real PDF summarizers)"""
-    prompt = f"""
-    Please provide a concise summary of the following document in no more than {max_words} words. 
-    Focus on the main points, key findings, and conclusions.
-    
-    Document:
-    {text[:8000]}
-    """
-    return call_ai_inference(prompt).strip()
+    def nbytes(self) -> int:
+        size = self.lengths.nbytes + self.alive.nbytes + 8 * len(self.owners)
+        size += sum(len(member["content"]) for member in self.members.values())
+        for term, blocks in self.postings.items():
+            size += len(term) + 100 + sum(ids.nbytes + tfs.nbytes for ids, tfs in blocks)
+        return size
 
-def find_relevant_text(document_text: str, query: str, context_words: int = 100) -> str:
-    """Find and return relevant text snippets from document"""
-    try:
-        # Simple keyword-based search for highlighting
-        words = query.lower().split()
-        sentences = document_text.split('.')
-        
-        relevant_sentences = []
-        for sentence in sentences:
-            sentence_lower = sentence.lower()
-            if any(word in sentence_lower for word in words):
-                relevant_sentences.append(sentence.strip())
-        
-        if relevant_sentences:
-            return '. '.join(relevant_sentences[:3])  # Return top 3 relevant sentences
-        else:
-            return document_text[:500]  # Return first 500 chars if no specific match
-    except Exception:
-        return document_text[:500]
-
-@app.post("/upload", response_model=DocumentResponse)
-async def upload_document(file: UploadFile = File(...)):
-    """Upload and process document (PDF or TXT)"""
-    if not (file.filename and file.filename.lower().endswith(('.pdf', '.txt'))):
-        raise HTTPException(status_code=400, detail="Only PDF and TXT files are supported")
-    
-    try:
-        # Read file content
-        file_content = await file.read()
-        file_obj = io.BytesIO(file_content)
-        
-        # Extract text based on file type
-        if file.filename and file.filename.lower().endswith('.pdf'):
-            text = extract_text_from_pdf(file_obj)
-        else:
-            text = extract_text_from_txt(file_obj)
-        
-        if not text.strip():
-            raise HTTPException(status_code=400, detail="No text content found in the file")
-        
-        # Generate summary
-        summary = generate_summary(text)
-        
-        # Store document with session ID
-        session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-        document_storage[session_id] = {
-            "content": text,
-            "filename": file.filename,
-            "upload_time": datetime.now().isoformat(),
-            "summary": summary
-        }
-        
-        # Initialize conversation history
-        conversation_history[session_id] = []
-        
-        return {
-            "summary": summary,
-            "content": text[:1000] + "..." if len(text) > 1000 else text,
-            "filename": file.filename,
-            "upload_time": datetime.now().isoformat(),
-            "session_id": session_id
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing document: {str(e)}")
+    def digest(self) -> str:
+        """Identifies the set of documents, for caching answers over the whole collection"""
+        return hashlib.sha256(" ".join(sorted(self.members)).encode("utf-8")).hexdigest()
 
-@app.post("/ask", response_model=AnswerResponse)
-async def ask_question(request: QuestionRequest):
-    print("[DEBUG] /ask called. session_id:", request.session_id)
-    print("[DEBUG] Current document_storage keys:", list(document_storage.keys()))
-    if request.session_id not in document_storage:
-        raise HTTPException(status_code=404, detail="Document not found. Please upload a document first.")
-    
-    document = document_storage[request.session_id]
-    
-    try:
-        # Add conversation history context
-        history_context = ""
-        if request.session_id in conversation_history:
-            recent_history = conversation_history[request.session_id][-5:]  # Last 5 interactions
-            history_context = "\n".join([f"Q: {h['question']}\nA: {h['answer']}" for h in recent_history])
-        
-        prompt = f"""
+collection_indexes: "OrderedDict[str, CorpusIndex]" = OrderedDict()  # session -> corpus, least recently used first
+
+async def get_collection(session_id: str, document: dict) -> Optional[CorpusIndex]:
+    """The session's corpus index, synced with its current documents; None while it holds just one"""
+    members = session_store.list_documents(session_id)
+    if len(members) < 2:
+        collection_indexes.pop(session_id, None)
+        return None
+    corpus = collection_indexes.get(session_id)
+    if corpus is None:
+        corpus = collection_indexes[session_id] = CorpusIndex()
+    collection_indexes.move_to_end(session_id)
+    while len(collection_indexes) > COLLECTION_CACHE_SIZE:
+        collection_indexes.popitem(last=False)
+    # Apply only the difference, so another worker's changes are picked up without a rebuild
+    wanted = {member["digest"]: member for member in members}
+    for digest in [digest for digest in corpus.members if digest not in wanted]:
+        corpus.remove_document(digest)
+    for digest, member in wanted.items():
+        if digest in corpus.members:
+            continue
+        stored = document if digest == document["digest"] else session_store.get_document(digest, with_index=False)
+        if stored is None:
+            continue
+        if stored["index"] is None:
+            stored["index"] = await load_index(digest, stored["content"])
+        corpus.add_document(digest, member["filename"], stored["index"], stored["content"])
+    return corpus
+
+def build_ask_prompt(question: str, history_context: str, context: str, sources: bool = False) -> str:
+    """Prompt used by /ask; with sources the context is excerpts from several files labelled [n]"""
+    citation_note = "The document is made of excerpts from several files, each labelled [n]; cite the labels you rely on.\n" if sources else ""
+    return f"""
         Based on the following document, answer the question with contextual understanding.
         Provide a clear answer and justify it with specific references from the document.
         Do not hallucinate or fabricate information not present in the document.
-        
+        {citation_note}
         Previous conversation context:
         {history_context}
         
         Document:
-        {document['content']}
+        {context}
         
-        Question: {request.question}
+        Question: {question}
         
         Please provide:
         1. A clear answer
         2. Justification with specific references from the document
         3. A confidence score (0-1)
         """
-        
-        answer_text = call_ai_inference(prompt).strip()
-        
-        # Extract highlighted text from document
-        highlighted_text = find_relevant_text(document['content'], request.question)
-        
-        # Store in conversation history
-        conversation_history[request.session_id].append({
-            "question": request.question,
-            "answer": answer_text,
-            "timestamp": datetime.now().isoformat()
+
+def find_relevant_text(document: dict, query: str, top_n: int = HIGHLIGHT_TOP_N) -> tuple:
+    """Return the relevant text for display and its ranked spans with character offsets"""
+    text = document['content']
+    spans = document['index'].highlight(query, top_n)
+    if not spans:
+        return text[:500], []  # Return first 500 chars if no specific match
+    for span in spans:
+        span["text"] = text[span["start"]:span["end"]]
+    return " ".join(span["text"] for span in spans), spans
+
+def find_collection_text(collection: CorpusIndex, citations: List[dict], query: str, top_n: int = HIGHLIGHT_TOP_N) -> tuple:
+    """find_relevant_text over the cited documents of a collection; spans carry their filename"""
+    spans = []
+    for digest in dict.fromkeys(citation["digest"] for citation in citations):
+        member = collection.members.get(digest)
+        if member is None:
+            continue
+        for span in member["index"].highlight(query, top_n):
+            span["text"] = member["content"][span["start"]:span["end"]]
+            span["filename"] = member["filename"]
+            spans.append(span)
+    spans = sorted(spans, key=lambda span: -span["score"])[:top_n]
+    if not spans:
+        return " ... ".join(citation["text"][:200] for citation in citations[:3]), []
+    return " ".join(span["text"] for span in spans), spans
+
+# Prompt budget
+MODEL_CONTEXT_TOKENS = int(os.getenv("MODEL_CONTEXT_TOKENS", "16385"))  # gpt-3.5-turbo
+PROMPT_TOKEN_BUDGET = min(int(os.getenv("PROMPT_TOKEN_BUDGET", "4000")), MODEL_CONTEXT_TOKENS - LLM_MAX_TOKENS)
+QUESTION_TOKEN_BUDGET = int(os.getenv("QUESTION_TOKEN_BUDGET", "300"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "600"))
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "200"))  # share of the history budget
+HISTORY_RECENT_TURNS = int(os.getenv("HISTORY_RECENT_TURNS", "2"))  # turns kept verbatim
+HISTORY_SUMMARY_LINE_TOKENS = 60
+
+def clip_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text on a word boundary so it fits in max_tokens"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    clipped = text[:max(0, max_tokens - 2) * 4]
+    return clipped.rsplit(" ", 1)[0] + "..."
+
+def format_turn(entry: dict) -> str:
+    return f"Q: {entry['question']}\nA: {entry['answer']}"
+
+def roll_into_summary(summary: str, entry: dict) -> str:
+    """Fold one turn into the running summary as a single line; the oldest lines drop out past HISTORY_SUMMARY_TOKENS"""
+    match = SENTENCE_PATTERN.search(entry["answer"].strip())
+    gist = match.group().strip() if match else ""
+    line = clip_to_tokens(f"- {entry['question'].strip()} -> {gist}", HISTORY_SUMMARY_LINE_TOKENS)
+    lines = summary.splitlines() if summary else []
+    lines.append(line)
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > HISTORY_SUMMARY_TOKENS:
+        lines.pop(0)
+    return "\n".join(lines)
+
+def build_history_context(session_id: str) -> tuple:
+    """Recent turns verbatim after a running summary of the older ones; returns (context, total turns)
+
+    Turns leave the verbatim window oldest first, when there are more than
+    HISTORY_RECENT_TURNS of them or they no longer fit the history budget.
+    Each is folded into the stored summary once, so nothing is re-summarized.
+    The latest turn is never folded, only clipped.
+    """
+    history = session_store.get_history(session_id)
+    summary, rolled = session_store.get_history_summary(session_id)
+    start = rolled
+
+    def recent_tokens() -> int:
+        return sum(estimate_tokens(format_turn(entry)) for entry in history[rolled:])
+
+    while len(history) - rolled > 1 and (
+        len(history) - rolled > HISTORY_RECENT_TURNS
+        or estimate_tokens(summary) + recent_tokens() > HISTORY_TOKEN_BUDGET
+    ):
+        summary = roll_into_summary(summary, history[rolled])
+        rolled += 1
+    if rolled != start:
+        session_store.set_history_summary(session_id, summary, rolled)
+
+    parts = [f"Earlier questions, summarized:\n{summary}"] if summary else []
+    recent = "\n".join(format_turn(entry) for entry in history[rolled:])
+    if recent:
+        # The last turn always stays, clipped if it alone is over budget
+        parts.append(clip_to_tokens(recent, HISTORY_TOKEN_BUDGET - estimate_tokens("\n".join(parts))))
+    return "\n".join(parts), len(history)
+
+def context_token_budget(fixed_tokens: int) -> int:
+    """Tokens left for document context once the system text, instructions, question and history are placed"""
+    return max(0, min(CONTEXT_TOKEN_BUDGET, PROMPT_TOKEN_BUDGET - fixed_tokens))
+
+# Background ingestion jobs
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+INGESTION_CONCURRENCY = int(os.getenv("INGESTION_CONCURRENCY", "8"))
+JOB_EVENTS_POLL_SECONDS = 0.25
+JOB_TOKEN_POLL_SECONDS = 0.05  # while the summary is streaming
+JOB_SAVE_SECONDS = 0.2  # progress and summary tokens reach the session store at most this often
+
+# Extraction and indexing run on this pool so they never block the event loop
+def create_ingestion_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=INGESTION_WORKERS, thread_name_prefix="ingest")
+
+ingestion_executor: Optional[ThreadPoolExecutor] = None  # started on startup
+ingestion_slots = asyncio.Semaphore(INGESTION_CONCURRENCY)
+ingestion_jobs: Dict[str, dict] = {}  # jobs running in this process; all jobs are kept in the session store
+job_saves: Dict[str, float] = {}  # job id -> when it was last written to the store
+ingestion_tasks = set()  # Strong references so running jobs aren't garbage collected
+inflight_documents: Dict[str, asyncio.Future] = {}  # digest -> resolves when its ingestion ends
+index_builds: Dict[str, asyncio.Future] = {}  # digest -> index being rebuilt for a stored document
+
+def run_in_background(coro) -> asyncio.Task:
+    """Start work that outlives the request, holding a reference until it ends"""
+    async def detached():
+        # The task copies the request's context; its spans must not land in a profile already sent
+        current_profile.set(None)
+        return await coro
+
+    task = asyncio.create_task(detached())
+    ingestion_tasks.add(task)
+    task.add_done_callback(ingestion_tasks.discard)
+    return task
+
+def create_job(session_id: str, filename: str, digest: str) -> dict:
+    now = datetime.now().isoformat()
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "session_id": session_id,
+        "digest": digest,
+        "filename": filename,
+        "status": "queued",
+        "stage": "queued",
+        "progress": 0.0,
+        "error": None,
+        "partial_summary": "",
+        "result": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+    ingestion_jobs[job["job_id"]] = job
+    save_job(job, force=True)
+    return job
+
+def update_job(job: dict, **fields):
+    job.update(fields, updated_at=datetime.now().isoformat())
+    save_job(job, force="stage" in fields)
+
+def save_job(job: dict, force: bool = False):
+    """Write a running job through to the session store; progress alone at most every JOB_SAVE_SECONDS"""
+    now = time.monotonic()
+    if force or now - job_saves.get(job["job_id"], 0.0) >= JOB_SAVE_SECONDS:
+        job_saves[job["job_id"]] = now
+        session_store.save_job(job)
+
+def find_job(job_id: str) -> Optional[dict]:
+    """A job running here, or any job in the session store (possibly started by another worker)"""
+    return ingestion_jobs.get(job_id) or session_store.get_job(job_id)
+
+def extract_document(path: str, filename: str, digest: str, on_page=None) -> tuple:
+    """Extract text and chunks from a spooled upload, chunking each page (or TXT block) as soon as it is read"""
+    pages = []
+
+    def page_stream():
+        if filename.lower().endswith('.pdf'):
+            try:
+                for page_number, page_count, page_text in iter_pdf_pages(path, digest):
+                    pages.append(page_text)
+                    if on_page:
+                        on_page(page_number, page_count)
+                    yield page_text
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Error reading PDF: {str(e)}")
+        else:
+            try:
+                for block in iter_text_blocks(path, on_page):
+                    pages.append(block)
+                    yield block
+            except Exception as e:
+                raise HTTPException(status_code=400, detail=f"Error reading TXT: {str(e)}")
+
+    chunks = list(chunk_pages(page_stream()))
+    return "\n".join(pages), chunks
+
+async def ingest_document(job: dict, path: str, digest: str) -> dict:
+    """Extract, index and summarize a new document"""
+    loop = asyncio.get_running_loop()
+
+    def on_page(done: int, total: int):
+        update_job(job, progress=round(0.6 * done / total, 3))
+
+    async with ingestion_slots:
+        update_job(job, status="running", stage="extracting")
+        with span("extract"):
+            text, chunks = await loop.run_in_executor(
+                ingestion_executor, extract_document, path, job["filename"], digest, on_page
+            )
+        if not text.strip():
+            raise ValueError("No text content found in the file")
+
+        update_job(job, stage="indexing", progress=0.6)
+        with span("index"):
+            index = await loop.run_in_executor(ingestion_executor, build_document_index, text, chunks)
+
+        summary, fallback = await summarize_document(job, text, digest)
+    return {"content": text, "summary": summary, "summary_fallback": fallback, "index": index}
+
+async def summarize_document(job: dict, text: str, digest: str) -> tuple:
+    """Summarize for a job, streaming into its partial summary; returns (summary, whether the local fallback wrote any of it)"""
+    update_job(job, stage="summarizing", progress=0.7)
+
+    def on_token(chunk: str):
+        job["partial_summary"] += chunk
+        save_job(job)
+
+    def on_progress(done: int, total: int):
+        update_job(job, progress=round(0.7 + 0.25 * done / total, 3))
+
+    route = {}
+    with span("summarize"):
+        summary = await generate_summary(text, on_token=on_token, digest=digest, on_progress=on_progress, route=route)
+    return summary, route["fallback"]
+
+@contextmanager
+def claim_document(digest: str):
+    """Mark a document as being ingested in this process, so identical uploads wait for it"""
+    inflight_documents[digest] = asyncio.get_running_loop().create_future()
+    try:
+        yield
+    finally:
+        inflight_documents.pop(digest).set_result(None)
+
+async def run_ingestion_job(job: dict, path: str, digest: str, add_to_session: bool = False):
+    """Attach the spooled upload at path to a new session (or add it to the job's existing session),
+    ingesting it unless the same bytes are already stored. Deletes the file when done."""
+    session_id = job["session_id"]
+    upload_time = job["created_at"]
+    attach = session_store.add_document if add_to_session else session_store.create_session
+    try:
+        # Identical uploads in flight share one ingestion, in this worker or another
+        while digest in inflight_documents or session_store.ingesting(digest, job["job_id"]):
+            if job["stage"] != "waiting":
+                update_job(job, status="running", stage="waiting")
+            if digest in inflight_documents:
+                await asyncio.shield(inflight_documents[digest])
+            else:
+                await asyncio.sleep(JOB_EVENTS_POLL_SECONDS)
+
+        try:
+            attach(session_id, digest, job["filename"], upload_time)
+        except KeyError:
+            with claim_document(digest):
+                document = await ingest_document(job, path, digest)
+                attach(session_id, digest, job["filename"], upload_time, document)
+                schedule_challenge_precompute(digest)
+        else:
+            document = session_store.get_document(digest, with_index=False)
+            if document["summary_fallback"]:
+                # The shared summary was written by the local fallback; try the providers again for every session sharing it
+                with claim_document(digest):
+                    summary, fallback = await summarize_document(job, document["content"], digest)
+                    if not fallback:
+                        session_store.set_summary(digest, summary)
+
+        document = session_store.get_document(digest, with_index=False)
+        update_job(job, status="done", stage="done", progress=1.0, result={
+            "summary": document["summary"],
+            "content": document["content"][:1000] + "..." if len(document["content"]) > 1000 else document["content"],
+            "filename": job["filename"],
+            "upload_time": upload_time,
+            "session_id": session_id
         })
-        
-        return AnswerResponse(
-            answer=answer_text,
-            justification=f"Based on the document '{document['filename']}'",
-            highlighted_text=highlighted_text,
-            confidence=0.85  # Default confidence
-        )
-        
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error answering question: {str(e)}")
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        update_job(job, status="failed", stage="failed", error=f"Error processing document: {detail}")
+    finally:
+        os.unlink(path)
+        ingestion_jobs.pop(job["job_id"], None)
+        job_saves.pop(job["job_id"], None)
 
-@app.post("/challenge", response_model=ChallengeResponse)
-async def generate_challenge(session_id: str):
-    print("[DEBUG] /challenge called. session_id:", session_id)
-    print("[DEBUG] Current document_storage keys:", list(document_storage.keys()))
-    if session_id not in document_storage:
+async def load_index(digest: str, content: str) -> "DocumentIndex":
+    """A stored document's index; when this process holds none it is rebuilt on the ingestion pool,
+    once however many requests wait for it"""
+    index = session_store.cached_index(digest)
+    if index is not None:
+        return index
+    building = index_builds.get(digest)
+    if building is None:
+        building = asyncio.get_running_loop().run_in_executor(ingestion_executor, build_document_index, content)
+        index_builds[digest] = building
+
+        def built(future: asyncio.Future):
+            index_builds.pop(digest, None)
+            if not future.cancelled() and future.exception() is None:
+                session_store.cache_index(digest, future.result())
+        building.add_done_callback(built)
+    with span("index"):
+        return await asyncio.shield(building)
+
+async def get_document(session_id: str, with_index: bool = True) -> dict:
+    """Look up a processed document (with its index) or raise the matching HTTP error"""
+    document = session_store.get(session_id, with_index=False)
+    if document is None:
+        if session_store.session_pending(session_id):
+            raise HTTPException(status_code=409, detail="Document is still being processed. Please try again shortly.")
         raise HTTPException(status_code=404, detail="Document not found. Please upload a document first.")
+    if with_index and document["index"] is None:
+        document["index"] = await load_index(document["digest"], document["content"])
+    return document
+
+class UploadSpool:
+    """Multipart parser callbacks writing the "file" part straight to a temp file and hashing it"""
+
+    def __init__(self):
+        self.filename: Optional[str] = None
+        self.file = None
+        self.sha = hashlib.sha256()
+        self.size = 0
+        self.writing = False
+        self.header_field = b""
+        self.header_value = b""
+        self.disposition = b""
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self.disposition = b""
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self.header_value += data[start:end]
+
+    def on_header_end(self):
+        if self.header_field.lower() == b"content-disposition":
+            self.disposition = self.header_value
+        self.header_field = self.header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self.disposition)
+        if options.get(b"name") != b"file" or b"filename" not in options or self.file is not None:
+            return  # other form fields are skipped
+        filename = options[b"filename"].decode("utf-8", errors="replace")
+        if not filename.lower().endswith(('.pdf', '.txt')):
+            raise HTTPException(status_code=400, detail="Only PDF and TXT files are supported")
+        self.filename = filename
+        suffix = os.path.splitext(filename)[1].lower()
+        self.file = tempfile.NamedTemporaryFile(prefix="upload-", suffix=suffix, dir=UPLOAD_SPOOL_DIR, delete=False)
+        self.writing = True
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if not self.writing:
+            return
+        self.size += end - start
+        if self.size > UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"File is larger than {UPLOAD_MAX_BYTES} bytes")
+        block = memoryview(data)[start:end]
+        self.sha.update(block)
+        self.file.write(block)
+
+    def on_part_end(self):
+        self.writing = False
+
+    def discard(self):
+        if self.file is not None:
+            self.file.close()
+            os.unlink(self.file.name)
+
+async def spool_upload(request: Request) -> tuple:
+    """Stream the "file" part of a multipart upload into a temp file, hashing it as it arrives
+
+    The body is parsed as it is received, so the file is written to disk once
+    and a 413 comes as soon as it passes UPLOAD_MAX_BYTES. Returns (filename,
+    path, SHA-256 hex digest); the caller owns the file and must delete it.
+    """
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    if b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Send the document as multipart/form-data")
+    upload = UploadSpool()
+    parser = MultipartParser(params[b"boundary"], upload.callbacks())
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    except BaseException as e:
+        upload.discard()
+        if isinstance(e, MultipartParseError):
+            raise HTTPException(status_code=400, detail=f"Malformed upload: {e}")
+        raise
+    if upload.file is None:
+        raise HTTPException(status_code=400, detail='Send the document in a form field named "file"')
+    upload.file.close()
+    return upload.filename, upload.file.name, upload.sha.hexdigest()
+
+async def queue_upload(request: Request, session_id: Optional[str] = None) -> UploadAcceptedResponse:
+    """Spool an upload, then start its ingestion job for a new or existing session"""
+    filename, path, digest = await spool_upload(request)
+    add_to_session = session_id is not None
+    if not add_to_session:
+        session_id = uuid.uuid4().hex
+    job = create_job(session_id, filename, digest)
+    run_in_background(run_ingestion_job(job, path, digest, add_to_session))
+    
+    return UploadAcceptedResponse(
+        session_id=session_id,
+        job_id=job["job_id"],
+        filename=filename,
+        status=job["status"],
+        upload_time=job["created_at"]
+    )
+
+# The upload body is parsed by spool_upload, so its form is described here for the OpenAPI docs
+UPLOAD_REQUEST_BODY = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object", "required": ["file"], "properties": {"file": {"type": "string", "format": "binary"}}
+}}}}}
+
+@router.post("/upload", response_model=UploadAcceptedResponse, status_code=202, openapi_extra=UPLOAD_REQUEST_BODY)
+async def upload_document(request: Request):
+    """Upload a document (PDF or TXT) and queue it for background processing"""
+    return await queue_upload(request)
+
+@router.post("/sessions/{session_id}/documents", response_model=UploadAcceptedResponse, status_code=202, openapi_extra=UPLOAD_REQUEST_BODY)
+async def add_session_document(session_id: str, request: Request):
+    """Upload another document into an existing session, making it a collection searched by /ask"""
+    await get_document(session_id, with_index=False)
+    return await queue_upload(request, session_id)
+
+@router.get("/sessions/{session_id}/documents")
+async def list_session_documents(session_id: str):
+    """Documents in a session, first upload first"""
+    await get_document(session_id, with_index=False)
+    return {"session_id": session_id, "documents": session_store.list_documents(session_id)}
+
+@router.delete("/sessions/{session_id}/documents/{digest}")
+async def remove_session_document(session_id: str, digest: str):
+    """Remove a document added to a session; the session's first document can't be removed"""
+    document = await get_document(session_id, with_index=False)
+    if digest == document["digest"]:
+        raise HTTPException(status_code=409, detail="The session's first document can't be removed")
+    if not session_store.remove_document(session_id, digest):
+        raise HTTPException(status_code=404, detail="Document not found in this session")
+    return {"session_id": session_id, "documents": session_store.list_documents(session_id)}
+
+@router.get("/sessions/{session_id}/search")
+async def search_session(session_id: str, q: str = Query(..., min_length=1), top_k: int = Query(RETRIEVAL_TOP_K, ge=1, le=100)):
+    """Rank the chunks of every document in the session against a query, without calling the LLM"""
+    document = await get_document(session_id)
+    collection = await get_collection(session_id, document)
+    if collection is not None:
+        return {"session_id": session_id, "results": collection.search(q, top_k)}
+    chunks = document["index"].chunks
+    return {"session_id": session_id, "results": [
+        {"digest": document["digest"], "filename": document["filename"], "chunk_id": chunk_id, "score": round(score, 4), "text": chunks.chunks[chunk_id]}
+        for chunk_id, score in chunks.search(q, top_k)
+    ]}
+
+@router.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str):
+    """Poll the status and progress of an ingestion job"""
+    job = find_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Server-sent events with job progress until the job finishes"""
+    if find_job(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        last_update = None
+        sent_summary = 0
+        while True:
+            job = find_job(job_id)
+            if job is None:
+                return
+            if len(job["partial_summary"]) > sent_summary:
+                yield sse_event("token", {"text": job["partial_summary"][sent_summary:]})
+                sent_summary = len(job["partial_summary"])
+            if job["updated_at"] != last_update:
+                last_update = job["updated_at"]
+                yield sse_event("progress", job)
+            if job["status"] in ("done", "failed"):
+                return
+            await asyncio.sleep(JOB_TOKEN_POLL_SECONDS if job["stage"] == "summarizing" else JOB_EVENTS_POLL_SECONDS)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+def prepare_ask_prompt(request: QuestionRequest, document: dict, collection: Optional[CorpusIndex]) -> tuple:
+    """Return the prompt and whether its answer may be cached
+
+    The prompt is built within PROMPT_TOKEN_BUDGET; its estimated size per part
+    is left in document["prompt_tokens"] for the response.
+    """
+    question = clip_to_tokens(request.question, QUESTION_TOKEN_BUDGET)
+    # Add conversation history context
+    history_context, turns = build_history_context(request.session_id)
+    
+    sources = collection is not None
+    fixed_tokens = (
+        estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(build_ask_prompt("", "", "", sources))
+        + estimate_tokens(question) + estimate_tokens(history_context)
+    )
+    token_budget = context_token_budget(fixed_tokens)
+    # Only send the chunks relevant to the question, from every document in the session
+    if collection is None:
+        context = document['index'].select_context(request.question, token_budget=token_budget)
+        document["ask_digest"] = document["digest"]
+    else:
+        context, document["citations"] = collection.select_context(request.question, token_budget=token_budget)
+        if not document["citations"]:
+            context = document['index'].select_context(request.question, token_budget=token_budget)
+        document["collection"] = collection
+        document["ask_digest"] = collection.digest()
+    prompt = build_ask_prompt(question, history_context, context, sources)
+    document["prompt_tokens"] = {
+        "system": estimate_tokens(SYSTEM_PROMPT),
+        "history": estimate_tokens(history_context),
+        "context": estimate_tokens(context),
+        "question": estimate_tokens(question),
+        "total": estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(prompt)
+    }
+    # Answers depend on earlier turns, so only a session's opening question is cacheable
+    return prompt, turns == 0
+
+def ask_inputs(request: QuestionRequest) -> dict:
+    return {"question": normalize_question(request.question)}
+
+def finish_ask(request: QuestionRequest, document: dict, answer_text: str) -> AnswerResponse:
+    # Extract highlighted text from document
+    citations = document.get("citations", [])
+    if "collection" in document:
+        with span("highlight"):
+            highlighted_text, highlights = find_collection_text(document["collection"], citations, request.question)
+        filenames = ", ".join(f"'{name}'" for name in dict.fromkeys(c["filename"] for c in citations))
+        justification = f"Based on the documents {filenames}" if citations else "No matching passages in this session's documents"
+    else:
+        with span("highlight"):
+            highlighted_text, highlights = find_relevant_text(document, request.question)
+        justification = f"Based on the document '{document['filename']}'"
+    
+    # Store in conversation history
+    session_store.append_history(request.session_id, {
+        "question": request.question,
+        "answer": answer_text,
+        "timestamp": datetime.now().isoformat()
+    })
     
-    document = document_storage[session_id]
+    return AnswerResponse(
+        answer=answer_text,
+        justification=justification,
+        highlighted_text=highlighted_text,
+        highlights=highlights,
+        citations=citations,
+        prompt_tokens=document.get("prompt_tokens", {}),
+        confidence=0.85  # Default confidence
+    )
+
+@router.post("/ask", response_model=AnswerResponse)
+async def ask_question(request: QuestionRequest):
+    document = await get_document(request.session_id)
     
     try:
-        prompt = f"""
+        collection = await get_collection(request.session_id, document)
+        with span("retrieve"):
+            prompt, cacheable = prepare_ask_prompt(request, document, collection)
+        if cacheable:
+            answer = await cached_ai_inference("ask", document["ask_digest"], ask_inputs(request), prompt, request.question)
+        else:
+            answer = await call_ai_inference(prompt)
+        return finish_ask(request, document, answer.strip())
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error answering question: {str(e)}")
+
+@router.post("/ask/stream")
+async def ask_question_stream(request: QuestionRequest):
+    """Stream the answer as server-sent `token` events, then a `done` event with the full AnswerResponse"""
+    document = await get_document(request.session_id)
+    collection = await get_collection(request.session_id, document)
+    with span("retrieve"):
+        prompt, cacheable = prepare_ask_prompt(request, document, collection)
+    if cacheable:
+        chunks = cached_stream_ai_inference("ask", document["ask_digest"], ask_inputs(request), prompt, request.question)
+    else:
+        chunks = stream_ai_inference(prompt)
+
+    async def events():
+        parts = []
+        try:
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield sse_event("token", {"text": chunk})
+            yield sse_event("done", jsonable_encoder(finish_ask(request, document, "".join(parts).strip())))
+        except Exception as e:
+            yield sse_event("error", {"detail": f"Error answering question: {str(e)}"})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+def document_overview(document: dict) -> str:
+    """Whole short documents; for long ones the summary plus excerpts spread across the text"""
+    if len(document["content"]) <= SUMMARY_SECTION_CHARS:
+        return document["content"]
+    return f"Overview: {document['summary']}\n\nExcerpts:\n{document['index'].sample_context()}"
+
+# Challenge generation and answer evaluation
+EVALUATE_BATCH_SIZE = int(os.getenv("EVALUATE_BATCH_SIZE", "5"))  # answers per LLM call
+EVALUATE_BATCH_MAX = int(os.getenv("EVALUATE_BATCH_MAX", "100"))  # answers per request
+CHALLENGE_BATCH_MAX = int(os.getenv("CHALLENGE_BATCH_MAX", "100"))  # sessions per /challenge/batch request
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))  # LLM calls in flight per batch request
+PRECOMPUTE_CHALLENGES = os.getenv("PRECOMPUTE_CHALLENGES", "1") == "1"
+
+FALLBACK_QUESTIONS = [
+    {"question": "What is the main objective or purpose described in this document?", "expected_answer": "Based on document content", "difficulty": "medium"},
+    {"question": "What are the key findings or conclusions mentioned?", "expected_answer": "Based on document content", "difficulty": "medium"},
+    {"question": "What implications or recommendations are discussed?", "expected_answer": "Based on document content", "difficulty": "hard"}
+]
+
+challenge_tasks: Dict[str, asyncio.Task] = {}  # digest -> challenge being generated
+
+def parse_json_object(text: str) -> dict:
+    """Parse a response that must be exactly one JSON object (a surrounding code fence is allowed)"""
+    stripped = text.strip()
+    if stripped.startswith("```"):
+        stripped = re.sub(r"^```[a-zA-Z]*\s*|\s*```$", "", stripped)
+    try:
+        value = json.loads(stripped)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Response is not valid JSON: {e}")
+    if not isinstance(value, dict):
+        raise ValueError("Expected a JSON object")
+    return value
+
+def parse_challenge(response_text: str) -> List[ChallengeQuestion]:
+    try:
+        questions = [ChallengeQuestion(**q) for q in parse_json_object(response_text)["questions"]]
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"Invalid challenge JSON: {e}")
+    if not questions:
+        raise ValueError("Invalid challenge JSON: no questions")
+    return questions
+
+def build_challenge_prompt(document: dict) -> str:
+    return f"""
         Based on the following document, generate exactly 3 challenging questions that test:
         1. Comprehension and understanding
         2. Logical reasoning
         3. Critical thinking
         
         Make sure the questions can be answered from the document content.
-        Format your response as JSON with the following structure:
+        Respond with only a JSON object, no other text, with the following structure:
         {{
             "questions": [
                 {{
@@ -361,110 +3226,408 @@ async def generate_challenge(session_id: str):
         }}
         
         Document:
-        {document['content'][:6000]}  # Limit to avoid token limits
+        {document_overview(document)}
         """
-        
-        response_text = call_ai_inference(prompt).strip()
-        
-        # Extract JSON from response
-        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-        if json_match:
-            questions_data = json.loads(json_match.group())
-            questions = [ChallengeQuestion(**q) for q in questions_data['questions']]
-        else:
-            # Fallback questions if JSON parsing fails
-            questions = [
-                ChallengeQuestion(
-                    question="What is the main objective or purpose described in this document?",
-                    expected_answer="Based on document content",
-                    difficulty="medium"
-                ),
-                ChallengeQuestion(
-                    question="What are the key findings or conclusions mentioned?",
-                    expected_answer="Based on document content",
-                    difficulty="medium"
-                ),
-                ChallengeQuestion(
-                    question="What implications or recommendations are discussed?",
-                    expected_answer="Based on document content",
-                    difficulty="hard"
-                )
-            ]
-        
-        return ChallengeResponse(questions=questions, session_id=session_id)
-        
+
+async def generate_challenge_questions(document: dict) -> List[ChallengeQuestion]:
+    # The same document always gets the same challenge, so share it between users
+    try:
+        response_text = await cached_ai_inference("challenge", document["digest"], {}, build_challenge_prompt(document), validate=parse_challenge)
+        return parse_challenge(response_text)
+    except ValueError:
+        # The model ignored the format; answer with generic questions and leave the cache empty
+        return [ChallengeQuestion(**q) for q in FALLBACK_QUESTIONS]
+
+async def challenge_questions(document: dict) -> List[ChallengeQuestion]:
+    """Challenge for a document; concurrent requests for the same document share one generation"""
+    digest = document["digest"]
+    task = challenge_tasks.get(digest)
+    if task is None:
+        # Shared by every waiting request, so its spans belong to none of their profiles
+        task = run_in_background(generate_challenge_questions(document))
+        challenge_tasks[digest] = task
+        task.add_done_callback(lambda _: challenge_tasks.pop(digest, None))
+    return await asyncio.shield(task)
+
+async def precompute_challenge(digest: str):
+    """Generate a new document's challenge in the background so the first visitor gets it from the cache"""
+    document = session_store.get_document(digest, with_index=False)
+    if document is None:
+        return
+    try:
+        if document["index"] is None:
+            document["index"] = await load_index(digest, document["content"])
+        await challenge_questions({**document, "digest": digest})
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generating challenge: {str(e)}")
+        logger.warning("Challenge precompute failed: %s", e)
 
-@app.post("/evaluate", response_model=EvaluationResponse)
-async def evaluate_answer(request: UserAnswerRequest):
-    """Evaluate user's answer to a challenge question"""
-    if request.session_id not in document_storage:
-        raise HTTPException(status_code=404, detail="Document not found. Please upload a document first.")
-    
-    document = document_storage[request.session_id]
+def schedule_challenge_precompute(digest: str):
+    if not PRECOMPUTE_CHALLENGES or response_cache is None or not response_cache.enabled_for("challenge"):
+        return
+    run_in_background(precompute_challenge(digest))
+
+@router.post("/challenge", response_model=ChallengeResponse)
+async def generate_challenge(session_id: str):
+    document = await get_document(session_id)
     
     try:
-        prompt = f"""
+        return ChallengeResponse(questions=await challenge_questions(document), session_id=session_id)
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating challenge: {str(e)}")
+
+@router.post("/challenge/batch", response_model=BatchChallengeResponse)
+async def generate_challenge_batch(request: BatchChallengeRequest):
+    """Challenges for several sessions; each distinct document is generated once, failures are reported per session"""
+    if not 1 <= len(request.session_ids) <= CHALLENGE_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"Send between 1 and {CHALLENGE_BATCH_MAX} session ids")
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def one(session_id: str) -> BatchChallengeItem:
+        try:
+            document = await get_document(session_id)
+            async with slots:
+                return BatchChallengeItem(session_id=session_id, questions=await challenge_questions(document))
+        except HTTPException as e:
+            return BatchChallengeItem(session_id=session_id, error=e.detail)
+        except Exception as e:
+            return BatchChallengeItem(session_id=session_id, error=f"Error generating challenge: {str(e)}")
+
+    results = await asyncio.gather(*(one(session_id) for session_id in request.session_ids))
+    return BatchChallengeResponse(results=results, failed=sum(1 for item in results if item.error))
+
+def evaluation_context(document: dict, query: str) -> str:
+    """Whole short documents; for long ones the chunks relevant to the questions and answers"""
+    if len(document["content"]) <= SUMMARY_SECTION_CHARS:
+        return document["content"]
+    return document["index"].select_context(query)
+
+EVALUATION_FIELDS = '"score": <0-100>, "feedback": "Detailed feedback", "correct_answer": "Correct answer based on document", "justification": "Justification with document references"'
+
+def build_evaluation_prompt(request: UserAnswerRequest, document: dict) -> str:
+    return f"""
         Evaluate the user's answer to the question based on the document content.
-        Provide a score (0-100), feedback, and the correct answer with justification.
+        Respond with only a JSON object, no other text, with the following structure:
+        {{{EVALUATION_FIELDS}}}
         
         Document:
-        {document['content'][:6000]}
+        {evaluation_context(document, f"{request.question} {request.user_answer}")}
         
         Question: {request.question}
         User's Answer: {request.user_answer}
-        
-        Please evaluate and provide:
-        1. Score (0-100)
-        2. Detailed feedback
-        3. Correct answer based on document
-        4. Justification with document references
         """
+
+def build_batch_evaluation_prompt(items: List[tuple], document: dict) -> str:
+    """One prompt evaluating several (id, AnswerItem) pairs"""
+    answers = "\n\n".join(
+        f"Item {item_id}:\nQuestion: {item.question}\nUser's Answer: {item.user_answer}" for item_id, item in items
+    )
+    query = " ".join(f"{item.question} {item.user_answer}" for _, item in items)
+    return f"""
+        Evaluate each of the user's answers below based on the document content.
+        Respond with only a JSON object, no other text, with one entry per item id:
+        {{"evaluations": [{{"id": <item id>, {EVALUATION_FIELDS}}}]}}
         
-        evaluation_text = call_ai_inference(prompt).strip()
-        
-        # Extract score (simple pattern matching)
-        score_match = re.search(r'(\d+(?:\.\d+)?)', evaluation_text)
-        score = float(score_match.group(1)) if score_match else 75.0
+        Document:
+        {evaluation_context(document, query)}
         
+        {answers}
+        """
+
+def evaluation_inputs(request) -> dict:
+    return {"question": normalize_question(request.question), "user_answer": normalize_question(request.user_answer)}
+
+def evaluation_from_json(data: dict, document: dict) -> EvaluationResponse:
+    try:
+        score = data["score"]
+        if isinstance(score, bool) or not isinstance(score, (int, float)) or not 0 <= score <= 100:
+            raise ValueError(f"score must be a number from 0 to 100, got {score!r}")
         return EvaluationResponse(
             score=score / 100,  # Convert to 0-1 scale
-            feedback=evaluation_text,
-            correct_answer="Based on document analysis",
-            justification=f"Evaluated against document '{document['filename']}'"
+            feedback=str(data["feedback"]),
+            correct_answer=str(data.get("correct_answer") or "Based on document analysis"),
+            justification=str(data.get("justification") or f"Evaluated against document '{document['filename']}'")
         )
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid evaluation JSON: {e}")
+
+def parse_evaluation(evaluation_text: str, document: dict) -> EvaluationResponse:
+    return evaluation_from_json(parse_json_object(evaluation_text), document)
+
+async def evaluate_single(document: dict, item) -> EvaluationResponse:
+    prompt = build_evaluation_prompt(item, document)
+    evaluation_text = await cached_ai_inference(
+        "evaluate", document["digest"], evaluation_inputs(item), prompt,
+        validate=lambda text: parse_evaluation(text, document)
+    )
+    return parse_evaluation(evaluation_text, document)
+
+async def evaluate_batch(document: dict, items: list) -> tuple:
+    """Evaluate many answers to questions on one document; returns (results, LLM calls made)
+
+    Cached answers are served first. The rest go EVALUATE_BATCH_SIZE to a call,
+    at most BATCH_CONCURRENCY calls at a time. Items a batch response leaves out
+    or gets wrong are retried on their own; an item that still fails gets an error.
+    """
+    results: List[Optional[BatchEvaluationItem]] = [None] * len(items)
+    cache = response_cache if response_cache is not None and response_cache.enabled_for("evaluate") else None
+    pending = []
+    for index, item in enumerate(items):
+        cached = None
+        if cache is not None:
+            model = cache_model()
+            key = cache.make_key("evaluate", document["digest"], evaluation_inputs(item), model)
+            cached = cache.lookup("evaluate", key, document["digest"], model)
+        if cached is not None:
+            try:
+                results[index] = BatchEvaluationItem(index=index, result=parse_evaluation(cached, document))
+                continue
+            except ValueError:
+                pass
+        pending.append((index, item))
+
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+    calls = 0
+
+    async def run_single(index: int, item):
+        nonlocal calls
+        try:
+            async with slots:
+                calls += 1
+                results[index] = BatchEvaluationItem(index=index, result=await evaluate_single(document, item))
+        except Exception as e:
+            results[index] = BatchEvaluationItem(index=index, error=f"Error evaluating answer: {str(e)}")
+
+    async def run_group(group: List[tuple]):
+        nonlocal calls
+        if len(group) == 1:
+            await run_single(*group[0])
+            return
+        route = {}
+        evaluations = {}
+        try:
+            async with slots:
+                calls += 1
+                response_text = await call_ai_inference(build_batch_evaluation_prompt(group, document), route)
+            for entry in parse_json_object(response_text).get("evaluations", []):
+                if isinstance(entry, dict):
+                    evaluations[str(entry.get("id"))] = entry
+        except Exception as e:
+            logger.warning("Batch evaluation failed, evaluating answers one by one: %s", e)
+        retry = []
+        for index, item in group:
+            try:
+                result = evaluation_from_json(evaluations[str(index)], document)
+            except (KeyError, ValueError):
+                retry.append((index, item))
+                continue
+            results[index] = BatchEvaluationItem(index=index, result=result)
+            if cache is not None and route.get("provider") != "local":
+                model = cache_model(route["provider"])
+                cache.store("evaluate", cache.make_key("evaluate", document["digest"], evaluation_inputs(item), model),
+                            document["digest"], model, json.dumps(evaluations[str(index)]))
+        await asyncio.gather(*(run_single(index, item) for index, item in retry))
+
+    groups = [pending[i:i + EVALUATE_BATCH_SIZE] for i in range(0, len(pending), EVALUATE_BATCH_SIZE)]
+    await asyncio.gather(*(run_group(group) for group in groups))
+    return results, calls
+
+@router.post("/evaluate", response_model=EvaluationResponse)
+async def evaluate_answer(request: UserAnswerRequest):
+    """Evaluate user's answer to a challenge question"""
+    document = await get_document(request.session_id)
+    
+    try:
+        return await evaluate_single(document, request)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error evaluating answer: {str(e)}")
 
-@app.get("/sessions")
-async def get_sessions():
-    """Get all available document sessions"""
+@router.post("/evaluate/batch", response_model=BatchEvaluationResponse)
+async def evaluate_answers_batch(request: BatchEvaluationRequest):
+    """Evaluate many answers for one session in a few structured-output calls, with per-answer results"""
+    if not 1 <= len(request.answers) <= EVALUATE_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"Send between 1 and {EVALUATE_BATCH_MAX} answers")
+    document = await get_document(request.session_id)
+    results, calls = await evaluate_batch(document, request.answers)
+    return BatchEvaluationResponse(
+        session_id=request.session_id,
+        results=results,
+        failed=sum(1 for item in results if item.error),
+        llm_calls=calls
+    )
+
+@router.post("/evaluate/stream")
+async def evaluate_answer_stream(request: UserAnswerRequest):
+    """Stream the model's JSON as server-sent `token` events, then a `done` event with the parsed EvaluationResponse"""
+    document = await get_document(request.session_id)
+    prompt = build_evaluation_prompt(request, document)
+    chunks = cached_stream_ai_inference(
+        "evaluate", document["digest"], evaluation_inputs(request), prompt,
+        validate=lambda text: parse_evaluation(text, document)
+    )
+
+    async def events():
+        parts = []
+        try:
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield sse_event("token", {"text": chunk})
+            yield sse_event("done", jsonable_encoder(parse_evaluation("".join(parts).strip(), document)))
+        except Exception as e:
+            yield sse_event("error", {"detail": f"Error evaluating answer: {str(e)}"})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.get("/sessions")
+async def get_sessions(offset: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=500)):
+    """Page through available document sessions"""
+    sessions, total = session_store.list_sessions(offset, limit)
+    next_offset = offset + len(sessions)
     return {
-        "sessions": [
-            {
-                "session_id": sid,
-                "filename": doc["filename"],
-                "upload_time": doc["upload_time"]
-            }
-            for sid, doc in document_storage.items()
-        ]
+        "sessions": sessions,
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "next_offset": next_offset if next_offset < total else None
     }
 
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """Response cache hit/miss counters per endpoint (this process only)"""
+    if response_cache is None:
+        return {"enabled": False, "endpoints": {}}
+    return {"enabled": True, "endpoints": response_cache.stats}
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus metrics; queue depths and cache counters are read at scrape time"""
+    job_counts = session_store.job_counts()
+    cache_stats = response_cache.stats if response_cache is not None else {}
+    collected = [
+        ("ingestion_jobs", "gauge", "Ingestion jobs by status (finished jobs are kept up to JOB_HISTORY_LIMIT)",
+         [({"status": status}, job_counts.get(status, 0)) for status in ("queued", "running", "done", "failed")]),
+        ("llm_pending_requests", "gauge", "LLM calls waiting for or holding a provider slot",
+         [({"provider": name}, provider.pending) for name, provider in llm_providers.items()]),
+        ("llm_active_requests", "gauge", "LLM calls holding a provider slot",
+         [({"provider": name}, provider.active) for name, provider in llm_providers.items()]),
+        ("llm_circuit_state", "gauge", "1 for each provider's current circuit state (closed, open, half_open)",
+         [({"provider": name, "state": state}, int(health.state == state))
+          for name, health in llm_router.health.items() for state in ("closed", "open", "half_open")]),
+        ("llm_latency_p95_seconds", "gauge", "p95 of each provider's recent call latencies",
+         [({"provider": name}, p95) for name, health in llm_router.health.items()
+          if (p95 := health.latency_quantile(0.95)) is not None]),
+        ("response_cache_lookups_total", "counter", "Response cache lookups by endpoint and outcome",
+         [({"endpoint": endpoint, "outcome": outcome}, count)
+          for endpoint, counts in cache_stats.items() for outcome, count in counts.items()]),
+    ]
+    return PlainTextResponse(metrics.render(collected), media_type="text/plain; version=0.0.4")
+
 # Serve React frontend
-@app.get("/")
+@router.get("/")
 async def serve_frontend():
     """Serve the React frontend"""
     return FileResponse('frontend/build/index.html')
 
-# Mount static files
-if os.path.exists("frontend/build"):
-    app.mount("/static", StaticFiles(directory="frontend/build/static"), name="static")
+# Startup
+startup_state = {"ready": False, "warmup_ms": {}}
 
-@app.get("/PdfSum")
+def open_resources():
+    """Open the executor and stores, and give providers and event-loop-bound state fresh instances
+
+    The executor and stores exist only between startup and shutdown, so anything
+    driving the app in-process has to run its lifespan. Providers and semaphores
+    hold no connections until used and are rebuilt for the running loop.
+    """
+    global ingestion_executor, ingestion_slots, summary_slots, session_store, response_cache, llm_providers, llm_router
+    ingestion_executor = create_ingestion_executor()
+    ingestion_slots = asyncio.Semaphore(INGESTION_CONCURRENCY)
+    summary_slots = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+    session_store = open_session_store()
+    response_cache = open_response_cache()
+    llm_providers = create_llm_providers()
+    llm_router = ProviderRouter(llm_providers, LLM_PROVIDER_ORDER)
+    for state in (ingestion_jobs, job_saves, ingestion_tasks, inflight_documents, index_builds, challenge_tasks, collection_indexes):
+        state.clear()
+    startup_state.update(ready=False, warmup_ms={})
+
+async def close_resources():
+    """Cancel background jobs and close LLM connections, worker pools and stores"""
+    global ingestion_executor, session_store, response_cache
+    for task in list(ingestion_tasks):
+        task.cancel()
+    for provider in llm_providers.values():
+        await provider.aclose()
+    ingestion_executor.shutdown(wait=False, cancel_futures=True)
+    reset_pdf_process_pool()
+    session_store.close()
+    if response_cache is not None:
+        response_cache.close()
+    ingestion_executor = session_store = response_cache = None
+
+async def warm_up():
+    """Load what the first requests would otherwise pay for; runs in the background after startup"""
+    steps = [("pdf", lambda: import_off_loop("PyPDF2")), ("pdf_workers", start_pdf_workers)]
+    if openai_configured():
+        steps.append(("openai", llm_providers["openai"].load_client))
+    for name, step in steps:
+        started = time.perf_counter()
+        try:
+            await step()
+        except Exception as e:
+            # The first request needing it will load it (and report the error) instead
+            logger.warning("Warm-up step %s failed: %s", name, e)
+        startup_state["warmup_ms"][name] = round((time.perf_counter() - started) * 1000, 1)
+    startup_state["ready"] = True
+    logger.info("Warm-up finished: %s", startup_state["warmup_ms"])
+
+@router.get("/PdfSum")
 def health_check():
-    return {"status": "ok"}
+    """Liveness: answers as soon as the server is up, warm or not"""
+    return {"status": "ok", "ready": startup_state["ready"]}
+
+@router.get("/PdfSum/ready")
+def readiness_check():
+    """Readiness: 503 until the background warm-up has finished"""
+    ready = startup_state["ready"]
+    body = {"status": "ready" if ready else "warming_up", "warmup_ms": startup_state["warmup_ms"]}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+def create_app() -> FastAPI:
+    """Build the ASGI app (also usable as `uvicorn --factory app:create_app`)
+
+    Only the web layer is set up here; the lifespan opens the executor, stores
+    and providers on startup and closes them on shutdown (see open_resources).
+    The openai SDK and PDF parser are imported on first use or by the warm-up,
+    and clients, pools and indexes are created lazily, so the port is bound
+    without waiting for them.
+    """
+    app = FastAPI(title="Smart Research Assistant", version="1.0.0", lifespan=lifespan)
+
+    # Added first, so CORS wraps it and its 413s stay readable from the browser
+    app.add_middleware(UploadLimitMiddleware)
+
+    # Configure CORS
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],  # For production, use your Vercel URL instead of "*"
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["Server-Timing"],
+    )
+    # Outermost, so it times every response
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(router)
+
+    # Mount static files
+    if os.path.exists("frontend/build"):
+        app.mount("/static", StaticFiles(directory="frontend/build/static"), name="static")
+    return app
+
+app = create_app()
 
 if __name__ == "__main__":
+    import uvicorn
+
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,95 @@
+"""
+A classroom finishing a quiz: one /evaluate per answer vs /evaluate/batch.
+
+Each of --users users answers the three challenge questions for one document.
+The per-answer run sends every answer serially, as ChallengeMode used to; the
+batch run sends one /evaluate/batch per user, all users at once. Runs against
+the local fake OpenAI server with the response cache off:
+
+    python benchmarks/batch_evaluation_benchmark.py --users 30 --latency-ms 300
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import httpx  # noqa: E402
+
+import fake_llm_server  # noqa: E402
+
+
+def user_answers(user: int, questions: list) -> list:
+    return [{"question": q["question"], "user_answer": f"User {user} thinks the answer is part {n}."} for n, q in enumerate(questions)]
+
+
+async def per_answer(client: httpx.AsyncClient, session_id: str, users: int, questions: list) -> dict:
+    before = fake_llm_server.stats["requests"]
+    started = time.perf_counter()
+    for user in range(users):
+        for answer in user_answers(user, questions):
+            response = await client.post("/evaluate", json={"session_id": session_id, **answer})
+            response.raise_for_status()
+    return {
+        "mode": "per_answer",
+        "wall_ms": round((time.perf_counter() - started) * 1000, 1),
+        "llm_calls": fake_llm_server.stats["requests"] - before,
+    }
+
+
+async def batched(client: httpx.AsyncClient, session_id: str, users: int, questions: list) -> dict:
+    before = fake_llm_server.stats["requests"]
+    started = time.perf_counter()
+
+    async def submit(user: int) -> dict:
+        response = await client.post("/evaluate/batch", json={"session_id": session_id, "answers": user_answers(user, questions)})
+        response.raise_for_status()
+        return response.json()
+
+    results = await asyncio.gather(*(submit(user) for user in range(users)))
+    return {
+        "mode": "batch",
+        "wall_ms": round((time.perf_counter() - started) * 1000, 1),
+        "llm_calls": fake_llm_server.stats["requests"] - before,
+        "failed_items": sum(result["failed"] for result in results),
+    }
+
+
+async def main_async(args):
+    import app as server
+
+    # ASGITransport doesn't run the lifespan, which opens the stores and closes the providers
+    async with server.lifespan(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=600) as client:
+            upload = await client.post("/upload", files={"file": ("doc.txt", b"The method and the results are described. " * 200, "text/plain")})
+            upload.raise_for_status()
+            session_id = upload.json()["session_id"]
+            while (await client.get(f"/jobs/{upload.json()['job_id']}")).json()["status"] not in ("done", "failed"):
+                await asyncio.sleep(0.01)
+            challenge = await client.post("/challenge", params={"session_id": session_id})
+            challenge.raise_for_status()
+            questions = challenge.json()["questions"]
+            results = [await per_answer(client, session_id, args.users, questions), await batched(client, session_id, args.users, questions)]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=30)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    args = parser.parse_args()
+
+    url = fake_llm_server.start_in_thread(latency_ms=args.latency_ms)
+    os.environ["OPENAI_API_KEY"] = "sk-fake"
+    os.environ["OPENAI_BASE_URL"] = f"{url}/v1"
+    os.environ["RESPONSE_CACHE"] = "off"
+    print(json.dumps(asyncio.run(main_async(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Cross-document search latency as a session's collection grows.
+
+Adds synthetic documents one at a time to the incremental corpus index used by
+/ask and /sessions/{id}/search, and at each checkpoint compares its query time
+with searching every document's own index in turn. Then it removes and re-adds
+random documents --churn times and checks that slots and query time stay flat:
+
+    python benchmarks/collection_benchmark.py --documents 10 100 1000 3000 --churn 200
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from retrieval_benchmark import QUESTION, synthetic_document  # noqa: E402
+
+import app as server  # noqa: E402
+
+
+def per_document_search(indexes: list, query: str, top_k: int) -> list:
+    hits = []
+    for digest, index in indexes:
+        hits.extend((score, digest, chunk_id) for chunk_id, score in index.chunks.search(query, top_k))
+    return sorted(hits, reverse=True)[:top_k]
+
+
+def median_ms(run, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(timings), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, nargs="+", default=[10, 100, 1000, 3000])
+    parser.add_argument("--pages", type=int, default=1, help="pages per synthetic document")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--churn", type=int, default=200, help="remove/re-add cycles after the last checkpoint")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = server.CorpusIndex()
+    indexes = []
+    texts = {}
+    add_ms = []
+    results = []
+    for target in sorted(args.documents):
+        while len(indexes) < target:
+            digest = f"doc-{len(indexes)}"
+            texts[digest] = synthetic_document(args.pages, seed=len(indexes))
+            index = server.build_document_index(texts[digest])
+            started = time.perf_counter()
+            corpus.add_document(digest, f"{digest}.txt", index, texts[digest])
+            add_ms.append((time.perf_counter() - started) * 1000)
+            indexes.append((digest, index))
+
+        corpus.search(QUESTION)  # merge postings blocks left by the additions
+        results.append({
+            "documents": target,
+            "chunks": corpus.live_chunks,
+            "add_ms_median": round(statistics.median(add_ms), 3),
+            "corpus_query_ms": median_ms(lambda: corpus.search(QUESTION), args.repeat),
+            "per_document_query_ms": median_ms(lambda: per_document_search(indexes, QUESTION, server.RETRIEVAL_TOP_K), args.repeat),
+            "corpus_mb": round(corpus.nbytes() / 1e6, 2),
+        })
+        print(json.dumps(results[-1]))
+
+    started = time.perf_counter()
+    corpus.remove_document(indexes[0][0])
+    remove_ms = round((time.perf_counter() - started) * 1000, 3)
+
+    corpus.add_document(indexes[0][0], f"{indexes[0][0]}.txt", indexes[0][1], texts[indexes[0][0]])
+
+    rng = random.Random(args.seed)
+    before = {"slots": corpus.size, "query_ms": median_ms(lambda: corpus.search(QUESTION), args.repeat)}
+    for _ in range(args.churn):
+        digest, index = rng.choice(indexes)
+        corpus.remove_document(digest)
+        corpus.add_document(digest, f"{digest}.txt", index, texts[digest])
+    corpus.search(QUESTION)
+    churn = {
+        "cycles": args.churn,
+        "live_chunks": corpus.live_chunks,
+        "slots_before": before["slots"],
+        "slots_after": corpus.size,
+        "query_ms_before": before["query_ms"],
+        "query_ms_after": median_ms(lambda: corpus.search(QUESTION), args.repeat),
+    }
+
+    print(json.dumps({"pages_per_document": args.pages, "remove_ms": remove_ms, "results": results, "churn": churn}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Local stand-in for the OpenAI and Hugging Face inference APIs.
+
+Responds after a configurable delay so benchmarks can exercise the real
+client code paths without network access or an API key:
+
+    python benchmarks/fake_llm_server.py --port 9000 --latency-ms 500
+    OPENAI_API_KEY=sk-fake OPENAI_BASE_URL=http://127.0.0.1:9000/v1 \\
+        HF_API_URL=http://127.0.0.1:9000/hf uvicorn app:app
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import socket
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+config = {
+    "latency_ms": 300.0,  # time before the first token
+    "tokens_per_second": 200.0,  # generation speed after the first token
+    "completion_tokens": 60,
+    "failure_rate": 0.0,  # fraction of requests answered with HTTP 500
+}
+stats = {"requests": 0, "failures": 0}
+
+stub = FastAPI(title="Fake LLM server")
+
+
+EVALUATION = {
+    "score": 80,
+    "feedback": "The answer covers the main points of the document.",
+    "correct_answer": "The document describes the method and the results.",
+    "justification": "See the results section.",
+}
+CHALLENGE = {"questions": [
+    {"question": f"What does part {n} of the document describe?", "expected_answer": "The method and the results", "difficulty": level}
+    for n, level in enumerate(["easy", "medium", "hard"], 1)
+]}
+
+
+def completion_text(prompt: str) -> str:
+    instruction = prompt.lstrip()[:200].lower()
+    if instruction.startswith("evaluate"):
+        item_ids = re.findall(r"^\s*Item (\d+):", prompt, re.MULTILINE)
+        if item_ids:
+            return json.dumps({"evaluations": [{"id": int(item_id), **EVALUATION} for item_id in item_ids]})
+        return json.dumps(EVALUATION)
+    if "challenging questions" in instruction:
+        return json.dumps(CHALLENGE)
+    words = ("The document describes the method the data and the results " * 20).split()
+    return " ".join(words[:config["completion_tokens"]])
+
+
+async def simulate(prompt: str) -> str:
+    stats["requests"] += 1
+    if random.random() < config["failure_rate"]:
+        stats["failures"] += 1
+        raise HTTPException(status_code=500, detail="injected failure")
+    text = completion_text(prompt)
+    await asyncio.sleep(config["latency_ms"] / 1000 + len(text.split()) / config["tokens_per_second"])
+    return text
+
+
+async def simulate_stream(prompt: str, model: str):
+    stats["requests"] += 1
+    if random.random() < config["failure_rate"]:
+        stats["failures"] += 1
+        raise HTTPException(status_code=500, detail="injected failure")
+
+    async def chunks():
+        await asyncio.sleep(config["latency_ms"] / 1000)
+        for index, word in enumerate(completion_text(prompt).split()):
+            if index:
+                await asyncio.sleep(1 / config["tokens_per_second"])
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": (" " if index else "") + word}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(chunks(), media_type="text/event-stream")
+
+
+@stub.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    prompt = body["messages"][-1]["content"]
+    if body.get("stream"):
+        return await simulate_stream(prompt, body.get("model", "fake"))
+    text = await simulate(prompt)
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+        "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(text.split()), "total_tokens": len(prompt) // 4 + len(text.split())},
+    }
+
+
+@stub.post("/hf")
+async def huggingface(request: Request):
+    body = await request.json()
+    text = await simulate(body["inputs"])
+    # Like the real text-generation task, echo the prompt unless return_full_text is off
+    if body.get("parameters", {}).get("return_full_text", True):
+        text = body["inputs"] + text
+    return [{"generated_text": text}]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_in_thread(port: int = 0, **overrides) -> str:
+    """Start the stub on a background thread and return its base URL"""
+    config.update(overrides)
+    port = port or free_port()
+    server = uvicorn.Server(uvicorn.Config(stub, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=config["latency_ms"])
+    parser.add_argument("--tokens-per-second", type=float, default=config["tokens_per_second"])
+    parser.add_argument("--completion-tokens", type=int, default=config["completion_tokens"])
+    parser.add_argument("--failure-rate", type=float, default=config["failure_rate"])
+    args = parser.parse_args()
+    config.update(
+        latency_ms=args.latency_ms,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        failure_rate=args.failure_rate,
+    )
+    uvicorn.run(stub, host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Per-query highlight time: the original substring scan vs the precomputed sentence index.
+
+    python benchmarks/highlight_benchmark.py --chars 1000000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import app as server  # noqa: E402
+
+QUERIES = [
+    "What was the measured catalyst yield in the pilot plant?",
+    "Which method improved the results?",
+    "How does the data analysis handle outliers?",
+    "What are the limitations of the study?",
+]
+
+
+def legacy_find_relevant_text(document_text: str, query: str) -> str:
+    # The original implementation, kept here for comparison
+    words = query.lower().split()
+    sentences = document_text.split('.')
+    relevant_sentences = []
+    for sentence in sentences:
+        sentence_lower = sentence.lower()
+        if any(word in sentence_lower for word in words):
+            relevant_sentences.append(sentence.strip())
+    if relevant_sentences:
+        return '. '.join(relevant_sentences[:3])
+    return document_text[:500]
+
+
+def synthetic_text(chars: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    vocab = [f"term{i}" for i in range(5000)] + ["the", "a", "of", "and", "results", "method", "data", "analysis"]
+    sentences = []
+    size = 0
+    while size < chars:
+        sentence = " ".join(rng.choice(vocab) for _ in range(rng.randint(8, 20))).capitalize() + "."
+        sentences.append(sentence)
+        size += len(sentence) + 1
+    sentences.insert(len(sentences) // 2, "The pilot plant measured a catalyst yield of 87 percent.")
+    return " ".join(sentences)
+
+
+def per_query_ms(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for query in QUERIES:
+            fn(query)
+    return (time.perf_counter() - started) * 1000 / (repeat * len(QUERIES))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chars", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    text = synthetic_text(args.chars)
+    started = time.perf_counter()
+    sentences = server.SentenceIndex(text)
+    build_ms = (time.perf_counter() - started) * 1000
+    document = {"content": text, "index": server.DocumentIndex(None, sentences)}
+    top = server.find_relevant_text(document, QUERIES[0])[1][0]
+
+    print(json.dumps({
+        "chars": len(text),
+        "sentences": len(sentences.starts),
+        "index_build_ms": round(build_ms, 1),
+        "legacy_ms_per_query": round(per_query_ms(lambda q: legacy_find_relevant_text(text, q), max(1, args.repeat // 10)), 3),
+        "indexed_ms_per_query": round(per_query_ms(lambda q: server.find_relevant_text(document, q), args.repeat), 3),
+        "top_span_for_first_query": top,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
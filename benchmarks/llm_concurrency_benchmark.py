@@ -0,0 +1,77 @@
+"""
+Concurrent /ask throughput against a local fake OpenAI server.
+
+With the async provider layer, throughput should grow with concurrency up to
+OPENAI_CONCURRENCY instead of staying at one request per completion latency:
+
+    python benchmarks/llm_concurrency_benchmark.py --concurrency 1 4 16 32
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import httpx  # noqa: E402
+
+import fake_llm_server  # noqa: E402
+
+
+async def run_level(client: httpx.AsyncClient, session_id: str, concurrency: int, requests_per_worker: int) -> dict:
+    latencies = []
+
+    async def worker():
+        for _ in range(requests_per_worker):
+            started = time.perf_counter()
+            response = await client.post("/ask", json={"question": "What are the results?", "session_id": session_id})
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1),
+    }
+
+
+async def main_async(args):
+    import app as server
+
+    # ASGITransport doesn't run the lifespan, which opens the stores and closes the providers
+    async with server.lifespan(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=120) as client:
+            upload = await client.post("/upload", files={"file": ("doc.txt", b"The method and the results are described. " * 200, "text/plain")})
+            upload.raise_for_status()
+            session_id = upload.json()["session_id"]
+            while (await client.get(f"/jobs/{upload.json()['job_id']}")).json()["status"] not in ("done", "failed"):
+                await asyncio.sleep(0.01)
+            results = [await run_level(client, session_id, level, args.requests_per_worker) for level in args.concurrency]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--requests-per-worker", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    args = parser.parse_args()
+
+    url = fake_llm_server.start_in_thread(latency_ms=args.latency_ms)
+    os.environ["OPENAI_API_KEY"] = "sk-fake"
+    os.environ["OPENAI_BASE_URL"] = f"{url}/v1"
+    print(json.dumps(asyncio.run(main_async(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
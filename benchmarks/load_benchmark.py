@@ -0,0 +1,272 @@
+"""
+Load and latency suite: realistic request mixes against a stub LLM.
+
+Boots the app in-process (httpx ASGI transport) or under uvicorn in a child
+process, points OpenAI and Hugging Face at benchmarks/fake_llm_server.py,
+uploads a synthetic PDF/TXT corpus and then runs each scenario with a fixed
+number of requests from --concurrency workers. Request choice is seeded, so two
+runs with the same arguments send the same requests:
+
+    python benchmarks/load_benchmark.py --scenarios ask study mixed --concurrency 16 --requests 400
+    python benchmarks/load_benchmark.py --server uvicorn --latency-ms 800 --output baseline.json
+
+Per scenario it reports p50/p95/p99 latency overall and per operation,
+throughput, errors, LLM calls and the app process's RSS, as JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import httpx  # noqa: E402
+
+import fake_llm_server  # noqa: E402
+from synthetic_pdf import synthetic_pdf  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Operation weights per scenario
+SCENARIOS = {
+    "ask": {"ask": 1.0},
+    "study": {"challenge": 0.3, "evaluate": 0.5, "evaluate_batch": 0.2},
+    "ingest": {"upload": 1.0},
+    "mixed": {"upload": 0.05, "ask": 0.6, "challenge": 0.15, "evaluate": 0.15, "evaluate_batch": 0.05},
+}
+QUESTIONS = [
+    "What was the measured catalyst yield in the pilot plant?",
+    "Which method produced the results?",
+    "How was the data collected?",
+    "What are the main limitations of the analysis?",
+    "Summarize the results section.",
+]
+
+
+def make_document(kind: str, pages: int, seed: int, synthetic_document) -> tuple:
+    """(filename, bytes, content type) of a synthetic PDF or TXT upload"""
+    if kind == "pdf":
+        return f"doc-{seed}.pdf", synthetic_pdf(pages, seed=seed), "application/pdf"
+    return f"doc-{seed}.txt", synthetic_document(pages, seed=seed).encode(), "text/plain"
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile of sorted values, in ms"""
+    if not values:
+        return 0.0
+    return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 1)
+
+
+def latency_summary(latencies: list) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+    }
+
+
+def process_memory(pid: int) -> dict:
+    """Current and peak RSS in MB from /proc (Linux); empty elsewhere"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            fields = dict(line.split(":", 1) for line in status)
+    except OSError:
+        return {}
+    return {
+        "rss_mb": round(int(fields["VmRSS"].split()[0]) / 1024, 1),
+        "peak_rss_mb": round(int(fields["VmHWM"].split()[0]) / 1024, 1),
+    }
+
+
+async def upload(client: httpx.AsyncClient, document: tuple) -> str:
+    """Upload a document and wait for its ingestion job; returns the session id"""
+    filename, content, content_type = document
+    response = await client.post("/upload", files={"file": (filename, content, content_type)})
+    response.raise_for_status()
+    job_id = response.json()["job_id"]
+    while True:
+        job = (await client.get(f"/jobs/{job_id}")).json()
+        if job["status"] == "done":
+            return job["session_id"]
+        if job["status"] == "failed":
+            raise RuntimeError(job["error"])
+        await asyncio.sleep(0.02)
+
+
+async def run_operation(client: httpx.AsyncClient, operation: str, rng: random.Random, sessions: list, new_document):
+    if operation == "upload":
+        sessions.append(await upload(client, new_document()))
+        return
+    session_id = rng.choice(sessions)
+    question = rng.choice(QUESTIONS)
+    if operation == "ask":
+        response = await client.post("/ask", json={"session_id": session_id, "question": question})
+    elif operation == "challenge":
+        response = await client.post("/challenge", params={"session_id": session_id})
+    elif operation == "evaluate":
+        response = await client.post("/evaluate", json={
+            "session_id": session_id, "question": question, "user_answer": f"I think answer {rng.randrange(1000)} is right."
+        })
+    else:
+        answers = [{"question": q, "user_answer": f"I think answer {rng.randrange(1000)} is right."} for q in rng.sample(QUESTIONS, 3)]
+        response = await client.post("/evaluate/batch", json={"session_id": session_id, "answers": answers})
+    response.raise_for_status()
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, sessions: list, new_document, args, app_pid: int) -> dict:
+    weights = SCENARIOS[name]
+    operations, cumulative = list(weights), list(weights.values())
+    latencies = {operation: [] for operation in operations}
+    errors = {operation: 0 for operation in operations}
+    remaining = [args.requests]
+
+    async def worker(worker_id: int):
+        rng = random.Random(f"{args.seed}-{name}-{worker_id}")
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            operation = rng.choices(operations, cumulative)[0]
+            started = time.perf_counter()
+            try:
+                await run_operation(client, operation, rng, sessions, new_document)
+            except Exception:
+                errors[operation] += 1
+                continue
+            latencies[operation].append(time.perf_counter() - started)
+
+    llm_calls = fake_llm_server.stats["requests"]
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(worker_id) for worker_id in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    completed = [latency for values in latencies.values() for latency in values]
+    return {
+        "scenario": name,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "wall_s": round(elapsed, 2),
+        "throughput_rps": round(len(completed) / elapsed, 2),
+        "errors": sum(errors.values()),
+        "llm_calls": fake_llm_server.stats["requests"] - llm_calls,
+        "latency": latency_summary(completed),
+        "operations": {operation: {**latency_summary(latencies[operation]), "errors": errors[operation]} for operation in operations},
+        **process_memory(app_pid),
+    }
+
+
+def start_uvicorn(env: dict) -> tuple:
+    """Run the app under uvicorn in a child process; returns (process, base URL)"""
+    port = fake_llm_server.free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/PdfSum", timeout=1).status_code == 200:
+                return process, url
+        except httpx.TransportError:
+            pass
+        if process.poll() is not None:
+            break
+        time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("uvicorn did not become healthy")
+
+
+async def main_async(args) -> list:
+    # Imported here: both read their configuration from the environment at import time
+    from retrieval_benchmark import synthetic_document
+
+    process = None
+    if args.server == "uvicorn":
+        process, url = start_uvicorn(dict(os.environ))
+        client = httpx.AsyncClient(base_url=url, timeout=600, limits=httpx.Limits(max_connections=args.concurrency * 2))
+        app_pid = process.pid
+    else:
+        import app as server
+
+        # ASGITransport doesn't run the lifespan, which opens the stores and closes the providers
+        lifespan = server.lifespan(server.app)
+        await lifespan.__aenter__()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://app", timeout=600)
+        app_pid = os.getpid()
+
+    seeds = iter(range(args.seed * 1_000_000, (args.seed + 1) * 1_000_000))
+
+    def new_document() -> tuple:
+        seed = next(seeds)
+        return make_document("pdf" if seed % 2 else "txt", args.pages, seed, synthetic_document)
+
+    results = []
+    try:
+        async with client:
+            sessions = [await upload(client, new_document()) for _ in range(args.documents)]
+            for name in args.scenarios:
+                results.append(await run_scenario(client, name, sessions, new_document, args, app_pid))
+                print(json.dumps(results[-1]), file=sys.stderr)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        else:
+            await lifespan.__aexit__(None, None, None)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--documents", type=int, default=6, help="documents uploaded before the scenarios run")
+    parser.add_argument("--pages", type=int, default=10, help="pages per synthetic document")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--response-cache", choices=["off", "memory", "sqlite"], default="off")
+    parser.add_argument("--output", help="also write the report to this file")
+    args = parser.parse_args()
+
+    random.seed(args.seed)  # the stub's injected failures
+    url = fake_llm_server.start_in_thread(
+        latency_ms=args.latency_ms,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        failure_rate=args.failure_rate,
+    )
+    os.environ["OPENAI_API_KEY"] = "sk-fake"
+    os.environ["OPENAI_BASE_URL"] = f"{url}/v1"
+    os.environ["HF_API_URL"] = f"{url}/hf"
+    os.environ["RESPONSE_CACHE"] = args.response_cache
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+    started = time.perf_counter()
+    results = asyncio.run(main_async(args))
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "python": platform.python_version(),
+        "total_s": round(time.perf_counter() - started, 2),
+        "scenarios": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
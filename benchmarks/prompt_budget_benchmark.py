@@ -0,0 +1,81 @@
+"""
+Prompt size over a long /ask conversation: last five raw turns vs the prompt budget manager.
+
+Runs the app in-process with the LLM replaced by a stub that gives long answers,
+asks --turns questions in one session and reports the prompt tokens of every turn
+next to what the previous prompt builder (last 5 Q/A pairs verbatim) would send:
+
+    python benchmarks/prompt_budget_benchmark.py --turns 20 --answer-words 300
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+# Every turn must reach the prompt builder
+os.environ.setdefault("RESPONSE_CACHE", "off")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from retrieval_benchmark import synthetic_document, wait_for_job  # noqa: E402
+
+import app as server  # noqa: E402
+
+QUESTIONS = [
+    "What was the measured catalyst yield in the pilot plant?",
+    "Which method produced the results?",
+    "How was the data collected?",
+    "What are the main limitations?",
+]
+
+
+def previous_prompt_tokens(history: list, question: str, document: dict) -> int:
+    recent = history[-5:]
+    history_context = "\n".join(f"Q: {h['question']}\nA: {h['answer']}" for h in recent)
+    context = document["index"].select_context(question)
+    return server.estimate_tokens(server.SYSTEM_PROMPT) + server.estimate_tokens(server.build_ask_prompt(question, history_context, context))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--answer-words", type=int, default=300)
+    parser.add_argument("--pages", type=int, default=50)
+    args = parser.parse_args()
+
+    answer = " ".join(["The results show the method improved the yield."] * (args.answer_words // 8))
+
+    async def fake_llm(prompt: str, route: dict = None) -> str:
+        return answer
+
+    server.call_ai_inference = fake_llm
+    turns = []
+    with TestClient(server.app) as client:
+        text = synthetic_document(args.pages)
+        response = client.post("/upload", files={"file": ("doc.txt", text.encode(), "text/plain")})
+        response.raise_for_status()
+        session_id = wait_for_job(client, response.json()["job_id"])["session_id"]
+        document = server.session_store.get(session_id)
+
+        for turn in range(args.turns):
+            question = QUESTIONS[turn % len(QUESTIONS)]
+            previous = previous_prompt_tokens(server.session_store.get_history(session_id), question, document)
+            result = client.post("/ask", json={"question": question, "session_id": session_id})
+            result.raise_for_status()
+            tokens = result.json()["prompt_tokens"]
+            turns.append({"turn": turn + 1, "previous_total": previous, **tokens})
+            print(json.dumps(turns[-1]))
+
+    print(json.dumps({
+        "prompt_token_budget": server.PROMPT_TOKEN_BUDGET,
+        "previous_max": max(t["previous_total"] for t in turns),
+        "budgeted_max": max(t["total"] for t in turns),
+        "previous_sum": sum(t["previous_total"] for t in turns),
+        "budgeted_sum": sum(t["total"] for t in turns),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Compare /ask prompt size and latency: full-document prompts vs chunked retrieval.
+
+Runs the app in-process with the LLM call replaced by a latency model, so no
+API key or network access is needed:
+
+    python benchmarks/retrieval_benchmark.py --pages 10 100 500
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+# Repeated questions would otherwise be answered from the response cache
+os.environ.setdefault("RESPONSE_CACHE", "off")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import app as server  # noqa: E402
+
+WORDS_PER_PAGE = 500
+MODEL_CONTEXT_TOKENS = 16385  # gpt-3.5-turbo
+QUESTION = "What was the measured catalyst yield in the pilot plant?"
+NEEDLE = "The pilot plant measured a catalyst yield of 87 percent after tuning."
+
+
+def synthetic_document(pages: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    vocab = [f"term{i}" for i in range(5000)] + ["the", "a", "of", "and", "in", "results", "method", "data"]
+    sentences = []
+    for _ in range(pages * WORDS_PER_PAGE // 12):
+        sentences.append(" ".join(rng.choice(vocab) for _ in range(12)).capitalize() + ".")
+    sentences.insert(len(sentences) * 2 // 3, NEEDLE)
+    return " ".join(sentences)
+
+
+def modeled_llm_ms(prompt_tokens: int, base_ms: float, ms_per_1k_tokens: float) -> float:
+    return base_ms + prompt_tokens / 1000 * ms_per_1k_tokens
+
+
+def wait_for_job(client: TestClient, job_id: str) -> dict:
+    while True:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.01)
+
+
+def measure(client: TestClient, prompts: list, pages: int, args) -> dict:
+    text = synthetic_document(pages)
+
+    started = time.perf_counter()
+    response = client.post("/upload", files={"file": ("doc.txt", text.encode(), "text/plain")})
+    response.raise_for_status()
+    session_id = wait_for_job(client, response.json()["job_id"])["session_id"]
+    upload_ms = (time.perf_counter() - started) * 1000
+
+    # Today's behaviour: the whole document goes into every prompt
+    started = time.perf_counter()
+    baseline_prompt = server.build_ask_prompt(QUESTION, "", text)
+    prompts.append(baseline_prompt)
+    baseline_local_ms = (time.perf_counter() - started) * 1000
+    baseline_tokens = server.estimate_tokens(baseline_prompt)
+
+    # Retrieval: the real endpoint
+    local_ms = []
+    for _ in range(args.repeat):
+        prompts.clear()
+        started = time.perf_counter()
+        client.post("/ask", json={"question": QUESTION, "session_id": session_id}).raise_for_status()
+        local_ms.append((time.perf_counter() - started) * 1000)
+    retrieval_prompt = prompts[-1]
+    retrieval_tokens = server.estimate_tokens(retrieval_prompt)
+
+    server.session_store.delete(session_id)
+    return {
+        "pages": pages,
+        "document_chars": len(text),
+        "upload_ms": round(upload_ms, 1),
+        "baseline": {
+            "prompt_tokens": baseline_tokens,
+            "exceeds_context": baseline_tokens > MODEL_CONTEXT_TOKENS,
+            "local_ms": round(baseline_local_ms, 2),
+            "end_to_end_ms": round(baseline_local_ms + modeled_llm_ms(baseline_tokens, args.base_ms, args.ms_per_1k_tokens), 1),
+        },
+        "retrieval": {
+            "prompt_tokens": retrieval_tokens,
+            "exceeds_context": retrieval_tokens > MODEL_CONTEXT_TOKENS,
+            "needle_in_prompt": NEEDLE in retrieval_prompt,
+            "local_ms": round(sorted(local_ms)[len(local_ms) // 2], 2),
+            "end_to_end_ms": round(sorted(local_ms)[len(local_ms) // 2] + modeled_llm_ms(retrieval_tokens, args.base_ms, args.ms_per_1k_tokens), 1),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--base-ms", type=float, default=400.0, help="fixed LLM latency per call")
+    parser.add_argument("--ms-per-1k-tokens", type=float, default=60.0, help="LLM latency per 1k prompt tokens")
+    args = parser.parse_args()
+    prompts = []
+
+    async def fake_llm(prompt: str, route: dict = None) -> str:
+        prompts.append(prompt)
+        return "Score: 80. summary question answer"
+
+    server.call_ai_inference = fake_llm
+    with TestClient(server.app) as client:
+        print(json.dumps([measure(client, prompts, pages, args) for pages in args.pages], indent=2))
+
+
+if __name__ == "__main__":
+    main()
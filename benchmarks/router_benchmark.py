@@ -0,0 +1,123 @@
+"""
+Provider router under a slow tail and under an outage, with in-process stub providers.
+
+tail:   the primary answers in ~--fast-ms but --slow-fraction of its calls take
+        --slow-ms; compares latency percentiles and extra LLM calls with
+        hedging off and on.
+outage: the primary hangs for --timeout-ms and then fails on every call;
+        compares latency and wasted primary calls without and with the
+        circuit breaker.
+
+    python benchmarks/router_benchmark.py --calls 400 --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import app as server  # noqa: E402
+
+
+class StubProvider(server.LLMProvider):
+    """Sleeps for a sampled latency, then answers or raises"""
+
+    def __init__(self, name: str, latency, fail: bool = False):
+        super().__init__(concurrency=1000, max_retries=0)
+        self.name = name
+        self.latency = latency
+        self.fail = fail
+        self.calls = 0
+
+    async def _complete(self, prompt: str) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.latency())
+        if self.fail:
+            raise RuntimeError(f"{self.name} is down")
+        return f"answer from {self.name}"
+
+
+def percentiles(latencies: list) -> dict:
+    latencies = sorted(latencies)
+    pick = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 1)  # noqa: E731
+    return {"p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "mean_ms": round(sum(latencies) / len(latencies) * 1000, 1)}
+
+
+async def drive(router: server.ProviderRouter, calls: int, concurrency: int) -> tuple:
+    latencies, answered = [], {}
+    queue = iter(range(calls))
+
+    async def worker():
+        for _ in queue:
+            route = {}
+            started = time.perf_counter()
+            await router.complete("Question: what changed?", route)
+            latencies.append(time.perf_counter() - started)
+            answered[route["provider"]] = answered.get(route["provider"], 0) + 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, answered
+
+
+async def tail(args, hedge: bool) -> dict:
+    rng = random.Random(args.seed)
+    primary = StubProvider("primary", lambda: args.slow_ms / 1000 if rng.random() < args.slow_fraction else rng.gauss(args.fast_ms, args.fast_ms / 10) / 1000)
+    backup = StubProvider("backup", lambda: rng.gauss(args.backup_ms, args.backup_ms / 10) / 1000)
+    providers = {"primary": primary, "backup": backup, "local": server.LocalProvider(concurrency=1000, max_retries=0)}
+    router = server.ProviderRouter(providers, ["primary", "backup"], hedge=hedge, configured=lambda name: True)
+    latencies, answered = await drive(router, args.calls, args.concurrency)
+    return {
+        "scenario": "tail",
+        "hedge": hedge,
+        **percentiles(latencies),
+        "answered": answered,
+        "llm_calls": primary.calls + backup.calls,
+        "extra_calls_pct": round((primary.calls + backup.calls - args.calls) / args.calls * 100, 1),
+    }
+
+
+async def outage(args, breaker: bool) -> dict:
+    server.BREAKER_FAILURES = args.breaker_failures if breaker else 10 ** 9
+    primary = StubProvider("primary", lambda: args.timeout_ms / 1000, fail=True)
+    backup = StubProvider("backup", lambda: args.backup_ms / 1000)
+    providers = {"primary": primary, "backup": backup, "local": server.LocalProvider(concurrency=1000, max_retries=0)}
+    router = server.ProviderRouter(providers, ["primary", "backup"], hedge=False, configured=lambda name: True)
+    latencies, answered = await drive(router, args.calls, args.concurrency)
+    return {
+        "scenario": "outage",
+        "breaker": breaker,
+        **percentiles(latencies),
+        "answered": answered,
+        "primary_calls": primary.calls,
+    }
+
+
+async def main_async(args) -> list:
+    results = []
+    for run in (tail(args, False), tail(args, True), outage(args, False), outage(args, True)):
+        results.append(await run)
+        print(json.dumps(results[-1]), file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--fast-ms", type=float, default=200.0)
+    parser.add_argument("--slow-ms", type=float, default=3000.0)
+    parser.add_argument("--slow-fraction", type=float, default=0.05)
+    parser.add_argument("--backup-ms", type=float, default=300.0)
+    parser.add_argument("--timeout-ms", type=float, default=2000.0, help="how long a failing primary call hangs")
+    parser.add_argument("--breaker-failures", type=int, default=server.BREAKER_FAILURES)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(main_async(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
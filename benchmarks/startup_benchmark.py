@@ -0,0 +1,98 @@
+"""
+Cold start: time from launching uvicorn to the first healthy and the first ready response.
+
+Each trial starts a fresh `uvicorn app:app` process and polls /PdfSum (liveness)
+and then /PdfSum/ready (readiness, after the background warm-up), plus the time
+a bare `import app` takes in a fresh interpreter. Point --app-dir at another
+checkout (e.g. a `git worktree` of an older commit) to compare:
+
+    python benchmarks/startup_benchmark.py --trials 5
+    python benchmarks/startup_benchmark.py --trials 5 --app-dir /tmp/baseline
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url: str, process: subprocess.Popen, started: float, timeout: float) -> float:
+    """Seconds from started until url answers 200; None if it answers 404 (no such endpoint)"""
+    while time.perf_counter() - started < timeout:
+        try:
+            status = httpx.get(url, timeout=1).status_code
+            if status == 200:
+                return time.perf_counter() - started
+            if status == 404:
+                return None
+        except httpx.TransportError:
+            pass
+        if process.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        time.sleep(0.005)
+    raise RuntimeError(f"{url} not healthy after {timeout}s")
+
+
+def trial(app_dir: str, env: dict, timeout: float) -> dict:
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=app_dir, env=env, stderr=subprocess.DEVNULL,
+    )
+    try:
+        healthy = wait_for(f"http://127.0.0.1:{port}/PdfSum", process, started, timeout)
+        ready = wait_for(f"http://127.0.0.1:{port}/PdfSum/ready", process, started, timeout)
+    finally:
+        process.terminate()
+        process.wait()
+    return {"healthy_s": healthy, "ready_s": ready}
+
+
+def import_time(app_dir: str, env: dict) -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import app"], cwd=app_dir, env=env, check=True, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def median(values: list):
+    values = [value for value in values if value is not None]
+    return round(statistics.median(values) * 1000, 1) if values else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trials", type=int, default=5)
+    parser.add_argument("--app-dir", default=ROOT, help="directory containing the app.py to start")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    # A configured key makes the warm-up load the OpenAI client too; nothing is sent to it
+    env = {**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "sk-startup-benchmark"), "LOG_LEVEL": "WARNING"}
+    imports = [import_time(args.app_dir, env) for _ in range(args.trials)]
+    trials = [trial(args.app_dir, env, args.timeout) for _ in range(args.trials)]
+    print(json.dumps({
+        "app_dir": os.path.abspath(args.app_dir),
+        "trials": args.trials,
+        "import_ms_median": median(imports),
+        "time_to_healthy_ms_median": median([t["healthy_s"] for t in trials]),
+        "time_to_ready_ms_median": median([t["ready_s"] for t in trials]),
+        "time_to_healthy_ms": [round(t["healthy_s"] * 1000, 1) for t in trials],
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Wall-clock time of hierarchical summarization versus document length.
+
+Starts the stub LLM server, points the OpenAI client at it and summarizes
+synthetic documents of increasing size, cold and then again at a different
+max_words (which reuses the cached section summaries):
+
+    python benchmarks/summarization_benchmark.py --pages 5 50 200 --latency-ms 300
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import fake_llm_server  # noqa: E402
+
+
+async def timed(summary):
+    """Return (elapsed ms, LLM requests made) for one summary coroutine"""
+    before = fake_llm_server.stats["requests"]
+    started = time.perf_counter()
+    await summary
+    return round((time.perf_counter() - started) * 1000, 1), fake_llm_server.stats["requests"] - before
+
+
+async def run(server, synthetic_document, pages_list: list) -> list:
+    results = []
+    # The lifespan opens the response cache holding the section summaries and closes the providers
+    async with server.lifespan(server.app):
+        for pages in pages_list:
+            text = synthetic_document(pages, seed=pages)
+            digest = f"benchmark-{pages}"
+            cold_ms, cold_calls = await timed(server.generate_summary(text, max_words=150, digest=digest))
+            warm_ms, warm_calls = await timed(server.generate_summary(text, max_words=60, digest=digest))
+            results.append({
+                "pages": pages,
+                "chars": len(text),
+                "sections": len(server.split_sections(text)),
+                "cold_ms": cold_ms,
+                "cold_llm_calls": cold_calls,
+                "resummarize_ms": warm_ms,
+                "resummarize_llm_calls": warm_calls,
+            })
+            print(json.dumps(results[-1]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[5, 50, 200])
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    url = fake_llm_server.start_in_thread(latency_ms=args.latency_ms, tokens_per_second=args.tokens_per_second)
+    os.environ["OPENAI_API_KEY"] = "sk-fake"
+    os.environ["OPENAI_BASE_URL"] = f"{url}/v1"
+    os.environ["RESPONSE_CACHE"] = "memory"
+    os.environ["SUMMARY_CONCURRENCY"] = str(args.concurrency)
+    os.environ.setdefault("OPENAI_CONCURRENCY", str(args.concurrency))
+    # Both read their configuration at import time
+    import app as server
+    from retrieval_benchmark import synthetic_document
+
+    results = asyncio.run(run(server, synthetic_document, args.pages))
+    print(json.dumps({"latency_ms": args.latency_ms, "concurrency": args.concurrency, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Minimal PDF writer for generating benchmark documents without extra dependencies."""
+import random
+
+LINES_PER_PAGE = 45
+WORDS_PER_LINE = 11
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages: list) -> bytes:
+    """Build a PDF with one page per list item; each item is a list of text lines"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_refs = []
+    for lines in pages:
+        body = "BT /F1 10 Tf 12 TL 50 760 Td " + " ".join(f"({_escape(line)}) '" for line in lines) + " ET"
+        stream = body.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % content_ref
+        )
+        page_refs.append(len(objects))
+    kids = " ".join(f"{ref} 0 R" for ref in page_refs).encode()
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_refs))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, obj)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def synthetic_pages(page_count: int, seed: int = 0) -> list:
+    """Pages of pseudo-random prose lines"""
+    rng = random.Random(seed)
+    vocab = [f"term{i}" for i in range(3000)] + ["the", "a", "of", "and", "results", "method", "data", "analysis"]
+    return [
+        [" ".join(rng.choice(vocab) for _ in range(WORDS_PER_LINE)) + "." for _ in range(LINES_PER_PAGE)]
+        for _ in range(page_count)
+    ]
+
+
+def synthetic_pdf(page_count: int, seed: int = 0) -> bytes:
+    return make_pdf(synthetic_pages(page_count, seed))
@@ -23,9 +23,32 @@ import {
   QuestionAnswer,
   Psychology
 } from '@mui/icons-material';
-import axios from 'axios';
 import Highlighter from 'react-highlight-words';
 
+// Parse a server-sent event stream from a fetch response, calling onEvent(event, data) per event
+const readEventStream = async (response, onEvent) => {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const block = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = 'message';
+      let data = '';
+      block.split('\n').forEach(line => {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      });
+      if (data) onEvent(event, JSON.parse(data));
+    }
+  }
+};
+
 const AskAnything = ({ sessionId }) => {
   const [question, setQuestion] = useState('');
   const [conversation, setConversation] = useState([]);
@@ -62,29 +85,49 @@ const AskAnything = ({ sessionId }) => {
       if (!apiUrl) {
         throw new Error('API URL is not set. Please set REACT_APP_API_URL in your .env file.');
       }
-      const response = await axios.post(`${apiUrl}/ask`, {
-        question: question,
-        session_id: sessionId
+      const response = await fetch(`${apiUrl}/ask/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ question: question, session_id: sessionId })
       });
-      if (!response.data || typeof response.data.answer === 'undefined') {
-        throw new Error('Malformed response from server.');
+      if (!response.ok) {
+        const data = await response.json().catch(() => ({}));
+        throw new Error(data.detail || 'Failed to get answer');
       }
+
+      // Show the answer as it streams in, then fill in highlights and metadata
       const assistantMessage = {
         type: 'assistant',
-        content: response.data.answer,
-        justification: response.data.justification,
-        highlighted_text: response.data.highlighted_text,
-        confidence: response.data.confidence,
+        content: '',
         timestamp: new Date().toISOString()
       };
-
       setConversation(prev => [...prev, assistantMessage]);
+      const updateAssistant = (fields) => {
+        setConversation(prev => [...prev.slice(0, -1), { ...prev[prev.length - 1], ...fields }]);
+      };
+
+      let answer = '';
+      await readEventStream(response, (event, data) => {
+        if (event === 'token') {
+          answer += data.text;
+          updateAssistant({ content: answer });
+        } else if (event === 'done') {
+          updateAssistant({
+            content: data.answer,
+            justification: data.justification,
+            highlighted_text: data.highlighted_text,
+            confidence: data.confidence
+          });
+        } else if (event === 'error') {
+          throw new Error(data.detail);
+        }
+      });
       setQuestion('');
       
     } catch (err) {
-      setError(err.message || err.response?.data?.detail || 'Failed to get answer');
-      // Remove the user message if request failed
-      setConversation(prev => prev.slice(0, -1));
+      setError(err.message || 'Failed to get answer');
+      // Remove the user message (and any partial answer) if request failed
+      setConversation(prev => prev.slice(0, prev.indexOf(userMessage)));
     } finally {
       setIsLoading(false);
     }
@@ -31,6 +31,7 @@ const ChallengeMode = ({ sessionId }) => {
   const [questions, setQuestions] = useState([]);
   const [currentQuestionIndex, setCurrentQuestionIndex] = useState(0);
   const [userAnswer, setUserAnswer] = useState('');
+  const [answers, setAnswers] = useState([]);
   const [results, setResults] = useState([]);
   const [isLoading, setIsLoading] = useState(false);
   const [isEvaluating, setIsEvaluating] = useState(false);
@@ -42,12 +43,13 @@ const ChallengeMode = ({ sessionId }) => {
   const generateQuestions = async () => {
     setIsLoading(true);
     setError('');
+    setAnswers([]);
     setResults([]);
     setCurrentQuestionIndex(0);
     setChallengeCompleted(false);
 
     try {
-      const response = await axios.post(`${apiUrl}/challenge`, { session_id: sessionId });
+      const response = await axios.post(`${apiUrl}/challenge`, null, { params: { session_id: sessionId } });
       setQuestions(response.data.questions);
     } catch (err) {
       setError(err.response?.data?.detail || 'Failed to generate questions');
@@ -59,33 +61,41 @@ const ChallengeMode = ({ sessionId }) => {
   const submitAnswer = async () => {
     if (!userAnswer.trim()) return;
 
+    // Answers are collected locally and evaluated together after the last question
+    const allAnswers = [
+      ...answers.slice(0, currentQuestionIndex),
+      {
+        question: questions[currentQuestionIndex].question,
+        userAnswer: userAnswer,
+        difficulty: questions[currentQuestionIndex].difficulty
+      }
+    ];
+    setAnswers(allAnswers);
+
+    if (currentQuestionIndex < questions.length - 1) {
+      setUserAnswer('');
+      setCurrentQuestionIndex(prev => prev + 1);
+      return;
+    }
+
     setIsEvaluating(true);
     setError('');
 
     try {
-      const response = await axios.post(`${apiUrl}/evaluate`, {
-        question: questions[currentQuestionIndex].question,
-        user_answer: userAnswer,
-        session_id: sessionId
+      const response = await axios.post(`${apiUrl}/evaluate/batch`, {
+        session_id: sessionId,
+        answers: allAnswers.map(answer => ({ question: answer.question, user_answer: answer.userAnswer }))
       });
 
-      const result = {
-        question: questions[currentQuestionIndex].question,
-        userAnswer: userAnswer,
-        evaluation: response.data,
-        difficulty: questions[currentQuestionIndex].difficulty
-      };
-
-      setResults(prev => [...prev, result]);
+      setResults(allAnswers.map((answer, index) => ({
+        ...answer,
+        evaluation: response.data.results[index].result,
+        error: response.data.results[index].error
+      })));
       setUserAnswer('');
-
-      if (currentQuestionIndex < questions.length - 1) {
-        setCurrentQuestionIndex(prev => prev + 1);
-      } else {
-        setChallengeCompleted(true);
-      }
+      setChallengeCompleted(true);
     } catch (err) {
-      setError(err.response?.data?.detail || 'Failed to evaluate answer');
+      setError(err.response?.data?.detail || 'Failed to evaluate answers');
     } finally {
       setIsEvaluating(false);
     }
@@ -113,15 +123,17 @@ const ChallengeMode = ({ sessionId }) => {
   };
 
   const calculateOverallScore = () => {
-    if (results.length === 0) return 0;
-    const totalScore = results.reduce((sum, result) => sum + result.evaluation.score, 0);
-    return totalScore / results.length;
+    const evaluated = results.filter(result => result.evaluation);
+    if (evaluated.length === 0) return 0;
+    const totalScore = evaluated.reduce((sum, result) => sum + result.evaluation.score, 0);
+    return totalScore / evaluated.length;
   };
 
   const resetChallenge = () => {
     setQuestions([]);
     setCurrentQuestionIndex(0);
     setUserAnswer('');
+    setAnswers([]);
     setResults([]);
     setChallengeCompleted(false);
     setError('');
@@ -228,7 +240,9 @@ const ChallengeMode = ({ sessionId }) => {
                 disabled={isEvaluating || !userAnswer.trim()}
                 startIcon={isEvaluating ? <CircularProgress size={20} /> : <Send />}
               >
-                {isEvaluating ? 'Evaluating...' : 'Submit Answer'}
+                {isEvaluating
+                  ? 'Evaluating...'
+                  : currentQuestionIndex < questions.length - 1 ? 'Next Question' : 'Submit Answers'}
               </Button>
             </Box>
           </CardContent>
@@ -292,11 +306,15 @@ const ChallengeMode = ({ sessionId }) => {
                     size="small"
                     sx={{ mr: 1 }}
                   />
-                  <Chip
-                    label={`${Math.round(result.evaluation.score * 100)}%`}
-                    color={getScoreColor(result.evaluation.score)}
-                    size="small"
-                  />
+                  {result.evaluation ? (
+                    <Chip
+                      label={`${Math.round(result.evaluation.score * 100)}%`}
+                      color={getScoreColor(result.evaluation.score)}
+                      size="small"
+                    />
+                  ) : (
+                    <Chip label="Not evaluated" color="default" size="small" />
+                  )}
                 </Box>
                 
                 <Typography variant="body2" sx={{ mb: 1, fontWeight: 500 }}>
@@ -318,7 +336,7 @@ const ChallengeMode = ({ sessionId }) => {
                   <strong>Feedback:</strong>
                 </Typography>
                 <Typography variant="body2" color="text.secondary">
-                  {result.evaluation.feedback}
+                  {result.evaluation ? result.evaluation.feedback : result.error}
                 </Typography>
               </CardContent>
             </Card>
@@ -16,18 +16,34 @@ import {
 } from '@mui/icons-material';
 import axios from 'axios';
 
+const JOB_POLL_INTERVAL_MS = 1000;
+
 const DocumentUpload = ({ onUpload }) => {
   const [isUploading, setIsUploading] = useState(false);
   const [uploadProgress, setUploadProgress] = useState(0);
+  const [stage, setStage] = useState('');
   const [error, setError] = useState('');
   const [dragActive, setDragActive] = useState(false);
 
   const apiUrl = process.env.REACT_APP_API_URL;
 
+  // Poll the background ingestion job until the document is ready
+  const waitForJob = async (jobId) => {
+    while (true) {
+      const { data: job } = await axios.get(`${apiUrl}/jobs/${jobId}`);
+      setStage(job.stage);
+      setUploadProgress(Math.round(job.progress * 100));
+      if (job.status === 'done') return job.result;
+      if (job.status === 'failed') throw new Error(job.error || 'Failed to process file');
+      await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    }
+  };
+
   const uploadFile = async (file) => {
     setIsUploading(true);
     setError('');
     setUploadProgress(0);
+    setStage('uploading');
 
     try {
       const formData = new FormData();
@@ -45,14 +61,14 @@ const DocumentUpload = ({ onUpload }) => {
         },
       });
 
-      // Extract session ID from response (assuming it's in the upload timestamp)
-      const sessionId = response.data.session_id; // Use backend's session_id
-      onUpload(response.data, sessionId);
+      const documentData = await waitForJob(response.data.job_id);
+      onUpload(documentData, documentData.session_id); // Use backend's session_id
     } catch (err) {
-      setError(err.response?.data?.detail || 'Failed to upload file');
+      setError(err.response?.data?.detail || err.message || 'Failed to upload file');
     } finally {
       setIsUploading(false);
       setUploadProgress(0);
+      setStage('');
     }
   };
 
@@ -117,7 +133,7 @@ const DocumentUpload = ({ onUpload }) => {
             <Box sx={{ width: '100%', mt: 2 }}>
               <LinearProgress variant="determinate" value={uploadProgress} />
               <Typography variant="body2" color="text.secondary" sx={{ mt: 1 }}>
-                {uploadProgress}% Complete
+                {stage ? `${stage.charAt(0).toUpperCase()}${stage.slice(1)}: ` : ''}{uploadProgress}% Complete
               </Typography>
             </Box>
           </Box>
@@ -139,7 +155,7 @@ const DocumentUpload = ({ onUpload }) => {
               Choose File
             </Button>
             <Typography variant="caption" display="block" sx={{ mt: 2, color: 'text.secondary' }}>
-              Supported formats: PDF, TXT (Max 10MB)
+              Supported formats: PDF, TXT (Max 100MB)
             </Typography>
           </>
         )}
@@ -0,0 +1,34 @@
+"""
+PDF page extraction shared by app.py and the PDF worker processes.
+
+The process pool uses the spawn start method, so each worker imports the
+module its task function lives in. Keep this module free of app imports:
+workers then load only PyPDF2, not the web app, stores and providers.
+"""
+import mmap
+from contextlib import contextmanager
+from typing import List
+
+
+@contextmanager
+def open_pdf(pdf_path: str):
+    """PdfReader over a read-only mmap of the file
+
+    Given a path, PyPDF2 reads the whole file into a BytesIO; over an mmap the
+    OS pages the file in as the parser touches it and can drop it again.
+    """
+    import PyPDF2  # imported on first use (or by the startup warm-up) to keep cold starts short
+
+    with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        yield PyPDF2.PdfReader(view)
+
+
+def load_pdf_parser():
+    """Import PyPDF2 ahead of the first task; submitted once per worker by the warm-up"""
+    import PyPDF2  # noqa: F401
+
+
+def extract_pdf_page_range(pdf_path: str, start: int, stop: int) -> List[str]:
+    """Extract pages [start, stop) of a PDF; runs in a worker process"""
+    with open_pdf(pdf_path) as pdf_reader:
+        return [pdf_reader.pages[i].extract_text() or "" for i in range(start, stop)]